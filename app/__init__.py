@@ -7,6 +7,18 @@ from flask_moment import Moment
 from flask_sqlalchemy import SQLAlchemy
 from flask_pagedown import PageDown
 from config import config
+from .render import RenderCache
+from .fragments import FragmentCache
+from .page_cache import PageCache
+from .token_cache import TokenCache
+from .hashing import HashPool
+from .last_seen import LastSeenBuffer
+from .identity_cache import IdentityCache
+from .avatars import AvatarCache
+from .search import SearchIndex
+from .compression import Compress
+from .assets import Assets
+from .query_profiler import QueryProfiler
 
 # then creates them uninitialized (no app as arg)
 bootstrap = Bootstrap()
@@ -15,6 +27,18 @@ moment = Moment()
 db = SQLAlchemy()
 login_manager = LoginManager()
 pagedown = PageDown()
+render_cache = RenderCache()
+fragment_cache = FragmentCache()
+page_cache = PageCache()
+token_cache = TokenCache()
+hash_pool = HashPool()
+last_seen = LastSeenBuffer()
+identity_cache = IdentityCache()
+avatar_cache = AvatarCache()
+search_index = SearchIndex()
+compress = Compress()
+assets = Assets()
+query_profiler = QueryProfiler()
 # session protection setting changes what is stored for the session to try to prevent user tampering
 # strong stores client's ip, user agent and logs user out if there is a change
 login_manager.session_protection = "strong"
@@ -35,6 +59,21 @@ def create_app(config_name):
     moment.init_app(app)
     db.init_app(app)
     pagedown.init_app(app)
+    render_cache.init_app(app)
+    fragment_cache.init_app(app)
+    page_cache.init_app(app)
+    token_cache.init_app(app)
+    hash_pool.init_app(app)
+    last_seen.init_app(app)
+    identity_cache.init_app(app)
+    avatar_cache.init_app(app)
+    search_index.init_app(app)
+    compress.init_app(app)
+    assets.init_app(app)
+    query_profiler.init_app(app)
+
+    from .email import mail_queue
+    mail_queue.init_app(app)
     
     if not app.debug and not app.testing and not app.config['SSL_DISABLE']:
         from flask_sslify import SSLify
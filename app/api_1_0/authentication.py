@@ -1,7 +1,9 @@
-from flask import g, jsonify
+from flask import g
 from flask_httpauth import HTTPBasicAuth
-from ..models import User, AnonymousUser
+from ..models import User, AnonymousUser, UserSnapshot
+from .. import token_cache
 from . import api
+from .serializers import serialize
 from .errors import unauthorized, forbidden
 
 auth = HTTPBasicAuth()
@@ -13,7 +15,8 @@ def verify_password(email_or_token, password):
         g.current_user = AnonymousUser()
         return True
     if password == "":
-        g.current_user = User.verify_auth_token(email_or_token)
+        # Token users are cached snapshots, not ORM instances
+        g.current_user = token_cache.verify(email_or_token, UserSnapshot.load)
         g.token_used = True
         return g.current_user is not None
     user = User.query.filter_by(email=email_or_token).first()
@@ -44,4 +47,4 @@ def before_request():
 def get_token():
     if g.current_user.is_anonymous or g.token_used:
         return unauthorized("Invalid credentials")
-    return jsonify({"token": g.current_user.generate_auth_token(expiration=3600), "expiration": 3600})
+    return serialize({"token": g.current_user.generate_auth_token(expiration=3600), "expiration": 3600})
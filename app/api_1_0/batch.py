@@ -0,0 +1,67 @@
+from flask import request, current_app
+from ..exceptions import ValidationError
+
+
+def batch_size_check(count):
+    limit = current_app.config["BLOG_API_BATCH_MAX"]
+    if count == 0:
+        raise ValidationError("batch is empty")
+    if count > limit:
+        raise ValidationError("batch has %d items, the limit is %d" % (count, limit))
+
+
+def requested_ids():
+    """The ids from ?ids=1,2,3 in request order without duplicates"""
+    ids = []
+    for part in request.args.get("ids", "").split(","):
+        try:
+            id = int(part)
+        except ValueError:
+            raise ValidationError("ids must be a comma separated list of integers")
+        if id not in ids:
+            ids.append(id)
+    batch_size_check(len(ids))
+    return ids
+
+
+def batch_read(query, model, ids, name, options=None):
+    """Loads every requested row in one IN query
+    Returns the rows found and one result per id, 404 for the missing ones"""
+    rows = {row.id: row for row in query.filter(model.id.in_(ids))}
+    results = []
+    for id in ids:
+        row = rows.get(id)
+        if row is None:
+            results.append({"id": id, "status": 404, "error": "not found"})
+        else:
+            results.append({"id": id, "status": 200, name: row.to_json(**(options or {}))})
+    return [rows[id] for id in ids if id in rows], results
+
+
+def batch_items(name):
+    """The list of items to create from a {name: [...]} request body"""
+    if not isinstance(request.json, dict):
+        raise ValidationError("expected an object with a list of %s" % name)
+    items = request.json.get(name)
+    if not isinstance(items, list):
+        raise ValidationError("expected a list of %s" % name)
+    batch_size_check(len(items))
+    return items
+
+
+def validate_items(items, from_json):
+    """Runs every item through from_json, returns the new rows and one result per item.
+    Nothing should be inserted unless every item is valid"""
+    rows, results, valid = [], [], True
+    for index, item in enumerate(items):
+        try:
+            if not isinstance(item, dict):
+                raise ValidationError("item is not an object")
+            rows.append(from_json(item))
+            results.append({"index": index, "status": 201})
+        except ValidationError as e:
+            valid = False
+            rows.append(None)
+            results.append({"index": index, "status": 400, "error": "bad request",
+                            "message": e.args[0]})
+    return rows, results, valid
@@ -1,56 +1,51 @@
-from flask import request, jsonify, g, url_for, current_app
+from flask import request, g, url_for, current_app
 from . import api
-from ..models import Comment, Post, Permission
+from .serializers import serialize
+from ..models import Comment, Post, Permission, User
 from .decorators import permission_required
+from .pagination import paginate
+from .batch import batch_items, validate_items
+from .fields import json_options, embedded_parts
+from ..exceptions import ValidationError
+from ..conditional import conditional, make_etag, collection_etag
 from .. import db
 
 
 @api.route("/comments/")
 def get_comments():
-    page = request.args.get("page", 1, type=int)
-    pagination = Comment.query.order_by(Comment.timestamp.desc()).paginate(
-        page, per_page=current_app.config["BLOG_COMMENTS_PER_PAGE"],
-        error_out=False)
-    comments = pagination.items
-    prev = None
-    if pagination.has_prev:
-        prev = url_for("api.get_comments", page=page-1, _external=True)
-    next = None
-    if pagination.has_next:
-        next = url_for("api.get_comments", page=page+1, _external=True)
-    return jsonify({
-        "comments": [comment.to_json() for comment in comments],
+    options = json_options(Comment)
+    comments, prev, next, count = paginate(
+        Comment.with_authors(Comment.query), Comment, "api.get_comments",
+        per_page=current_app.config["BLOG_COMMENTS_PER_PAGE"])
+    return conditional(lambda: serialize({
+        "comments": [comment.to_json(**options) for comment in comments],
         "prev": prev,
         "next": next,
-        "count": pagination.total
-    })
+        "count": count
+    }), collection_etag(comments, prev, next, count, embedded_parts(comments, options)))
 
 
 @api.route("/comments/<int:id>")
 def get_comment(id):
+    options = json_options(Comment)
     comment = Comment.query.get_or_404(id)
-    return jsonify({"comment": comment.to_json()})
+    return conditional(lambda: serialize({"comment": comment.to_json(**options)}),
+                       make_etag(comment.etag_parts(), embedded_parts([comment], options)))
 
 @api.route('/posts/<int:id>/comments/')
 def get_post_comments(id):
+    options = json_options(Comment)
     post = Post.query.get_or_404(id)
-    page = request.args.get('page', 1, type=int)
-    pagination = post.comments.order_by(Comment.timestamp.asc()).paginate(
-        page, per_page=current_app.config['BLOG_COMMENTS_PER_PAGE'],
-        error_out=False)
-    comments = pagination.items
-    prev = None
-    if pagination.has_prev:
-        prev = url_for('api.get_post_comments', page=page-1, _external=True)
-    next = None
-    if pagination.has_next:
-        next = url_for('api.get_post_comments', page=page+1, _external=True)
-    return jsonify({
-        'comments': [comment.to_json() for comment in comments],
+    comments, prev, next, count = paginate(
+        Comment.with_authors(post.comments), Comment, 'api.get_post_comments',
+        per_page=current_app.config['BLOG_COMMENTS_PER_PAGE'],
+        ascending=True, id=id)
+    return conditional(lambda: serialize({
+        'comments': [comment.to_json(**options) for comment in comments],
         'prev': prev,
         'next': next,
-        'count': pagination.total
-    })
+        'count': count
+    }), collection_etag(comments, prev, next, count, embedded_parts(comments, options)))
 
 
 @api.route('/posts/<int:id>/comments/', methods=['POST'])
@@ -58,10 +53,47 @@ def get_post_comments(id):
 def new_post_comment(id):
     post = Post.query.get_or_404(id)
     comment = Comment.from_json(request.json)
-    comment.author = g.current_user
+    comment.author = User.query.get(g.current_user.id)
     comment.post = post
     db.session.add(comment)
     db.session.commit()
-    return jsonify(comment.to_json()), 201, \
+    return serialize(comment.to_json()), 201, \
         {'Location': url_for('api.get_comment', id=comment.id,
                              _external=True)}
+
+
+@api.route("/comments/batch", methods=["POST"])
+@permission_required(Permission.COMMENT)
+def new_comments():
+    """Creates every comment in one transaction, or none of them if any is invalid
+    Each item names the post it belongs to with post_id"""
+    items = batch_items("comments")
+
+    def post_id(item):
+        # bool is a subclass of int and a JSON true would otherwise find post 1
+        id = item.get("post_id") if isinstance(item, dict) else None
+        return id if isinstance(id, int) and not isinstance(id, bool) else None
+
+    post_ids = [post_id(item) for item in items if post_id(item) is not None]
+    posts = {post.id: post for post in Post.query.filter(Post.id.in_(post_ids))}
+
+    def from_json(item):
+        post = posts.get(post_id(item))
+        if post is None:
+            raise ValidationError("comment does not have a valid post_id")
+        return Comment.from_json(item)
+
+    comments, results, valid = validate_items(items, from_json)
+    if not valid:
+        return serialize({"results": results}), 400
+    author = User.query.get(g.current_user.id)
+    # attaching the post cascades the comment into the session, so wait until all are valid
+    for comment, item in zip(comments, items):
+        comment.post = posts[post_id(item)]
+        comment.author = author
+    db.session.add_all(comments)
+    db.session.commit()
+    for comment, result in zip(comments, results):
+        result["comment"] = comment.to_json()
+        result["location"] = url_for("api.get_comment", id=comment.id, _external=True)
+    return serialize({"results": results}), 201
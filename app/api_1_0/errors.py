@@ -1,22 +1,22 @@
-from flask import jsonify
 from . import api
+from .serializers import serialize
 from ..exceptions import ValidationError
 
 
 def bad_request(message):
-    response = jsonify({'error': 'bad request', 'message': message})
+    response = serialize({'error': 'bad request', 'message': message})
     response.status_code = 400
     return response
 
 
 def unauthorized(message):
-    response = jsonify({'error': 'unauthorized', 'message': message})
+    response = serialize({'error': 'unauthorized', 'message': message})
     response.status_code = 401
     return response
 
 
 def forbidden(message):
-    response = jsonify({'error': 'forbidden', 'message': message})
+    response = serialize({'error': 'forbidden', 'message': message})
     response.status_code = 403
     return response
 
@@ -0,0 +1,30 @@
+from flask import request
+from ..exceptions import ValidationError
+
+
+def split_arg(name):
+    value = request.args.get(name)
+    if not value:
+        return None
+    return [part.strip() for part in value.split(",") if part.strip()]
+
+
+def json_options(model):
+    """to_json keyword arguments for model from ?fields=id,body and ?embed=author
+    Both are checked before anything is queried, so a streamed response can't fail halfway"""
+    fields = split_arg("fields")
+    unknown = set(fields or ()) - set(model.json_fields)
+    if unknown:
+        raise ValidationError("unknown fields: %s" % ", ".join(sorted(unknown)))
+    embed = split_arg("embed") or []
+    unknown = set(embed) - set(model.json_embeds)
+    if unknown:
+        raise ValidationError("cannot embed %s" % ", ".join(sorted(unknown)))
+    return {"fields": fields, "embed": embed}
+
+
+def embedded_parts(rows, options):
+    """Embedded authors are part of the response, so their versions go into the ETag"""
+    if "author" not in options["embed"]:
+        return ()
+    return [row.author.etag_parts() if row.author else None for row in rows]
@@ -0,0 +1,98 @@
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from datetime import datetime
+from flask import request, url_for, current_app
+from .. import db
+from ..exceptions import ValidationError
+
+CURSOR_TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+
+def encode_cursor(item, direction, sort_by="timestamp"):
+    """Cursors are opaque to clients, they hold the (timestamp, id) key of the
+    boundary item and the direction to read in"""
+    raw = "{0}|{1}|{2}".format(direction,
+                               getattr(item, sort_by).strftime(CURSOR_TIMESTAMP_FORMAT),
+                               item.id)
+    return urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    try:
+        raw = urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+        direction, timestamp, id = raw.split("|")
+        if direction not in ("next", "prev"):
+            raise ValueError(direction)
+        return direction, datetime.strptime(timestamp, CURSOR_TIMESTAMP_FORMAT), int(id)
+    except (ValueError, TypeError, UnicodeError):
+        raise ValidationError("invalid cursor")
+
+
+def paginate(query, model, endpoint, per_page, ascending=False, sort_by="timestamp",
+             **values):
+    """Paginates a collection ordered by (timestamp, id), or another datetime column
+    Page number mode (?page=) uses OFFSET and always counts the rows
+    Cursor mode (?cursor=&limit=) seeks from the key of the last item seen,
+    so deep pages cost the same as the first one. Totals are only counted with ?count=1
+    Returns the page items, the prev/next links and the count"""
+    timestamp_column = getattr(model, sort_by)
+    if ascending:
+        order = [timestamp_column.asc(), model.id.asc()]
+    else:
+        order = [timestamp_column.desc(), model.id.desc()]
+    if "cursor" not in request.args and "limit" not in request.args:
+        page = request.args.get("page", 1, type=int)
+        pagination = query.order_by(*order).paginate(
+            page, per_page=per_page, error_out=False)
+        prev = None
+        if pagination.has_prev:
+            prev = url_for(endpoint, page=page-1, _external=True, **values)
+        next = None
+        if pagination.has_next:
+            next = url_for(endpoint, page=page+1, _external=True, **values)
+        return pagination.items, prev, next, pagination.total
+
+    limit = request.args.get("limit", per_page, type=int)
+    if limit < 1:
+        limit = per_page
+    limit = min(limit, current_app.config["BLOG_API_MAX_LIMIT"])
+    count = None
+    if request.args.get("count", 0, type=int):
+        count = query.order_by(None).count()
+
+    direction = "next"
+    cursor = request.args.get("cursor")
+    keyset = query
+    if cursor:
+        direction, timestamp, id = decode_cursor(cursor)
+        # Reading backwards flips both the comparison and the order
+        if (direction == "next") == ascending:
+            after = db.or_(timestamp_column > timestamp,
+                           db.and_(timestamp_column == timestamp, model.id > id))
+        else:
+            after = db.or_(timestamp_column < timestamp,
+                           db.and_(timestamp_column == timestamp, model.id < id))
+        keyset = keyset.filter(after)
+    if direction == "prev":
+        if ascending:
+            order = [timestamp_column.desc(), model.id.desc()]
+        else:
+            order = [timestamp_column.asc(), model.id.asc()]
+    # One extra row tells whether there is anything past this page without counting
+    items = keyset.order_by(*order).limit(limit + 1).all()
+    has_more = len(items) > limit
+    items = items[:limit]
+    if direction == "prev":
+        items.reverse()
+        has_prev, has_next = has_more, True
+    else:
+        has_prev, has_next = bool(cursor), has_more
+
+    prev = None
+    if has_prev and items:
+        prev = url_for(endpoint, cursor=encode_cursor(items[0], "prev", sort_by),
+                       limit=limit, _external=True, **values)
+    next = None
+    if has_next and items:
+        next = url_for(endpoint, cursor=encode_cursor(items[-1], "next", sort_by),
+                       limit=limit, _external=True, **values)
+    return items, prev, next, count
@@ -1,56 +1,80 @@
-from flask import jsonify, request, g, abort, url_for, current_app
+from flask import request, g, abort, url_for, current_app
 from .. import db
 from .decorators import permission_required
 from .errors import forbidden
 from . import api
-from ..models import Permission, Post
+from .serializers import serialize
+from .pagination import paginate
+from .batch import requested_ids, batch_read, batch_items, validate_items
+from .fields import json_options, embedded_parts
+from ..models import Permission, Post, User
+from ..conditional import conditional, make_etag, collection_etag
 
 
 @api.route("/posts/")
 def get_posts():
-    page = request.args.get('page', 1, type=int)
-    pagination = Post.query.paginate(
-       page, per_page=current_app.config['BLOG_POSTS_PER_PAGE'],
-       error_out=False)
-    posts = pagination.items
-    prev = None
-    if pagination.has_prev:
-        prev = url_for('api.get_posts', page=page-1, _external=True)
-    next = None
-    if pagination.has_next:
-       next = url_for('api.get_posts', page=page+1, _external=True)
-    return jsonify({
-       'posts': [post.to_json() for post in posts],
+    options = json_options(Post)
+    if "ids" in request.args:
+        posts, results = batch_read(Post.with_authors(Post.query), Post,
+                                    requested_ids(), "post", options)
+        return conditional(lambda: serialize({"results": results}),
+                           collection_etag(posts, embedded_parts(posts, options)))
+    posts, prev, next, count = paginate(
+        Post.with_authors(Post.query), Post, "api.get_posts",
+        per_page=current_app.config["BLOG_POSTS_PER_PAGE"])
+    return conditional(lambda: serialize({
+       'posts': [post.to_json(**options) for post in posts],
        'prev': prev,
        'next': next,
-       'count': pagination.total})
+       'count': count}),
+       collection_etag(posts, prev, next, count, embedded_parts(posts, options)))
        
     
 @api.route("/posts/<int:id>")
 def get_post(id):
+    options = json_options(Post)
     post = Post.query.get_or_404(id)
-    return jsonify(post.to_json())
+    return conditional(lambda: serialize(post.to_json(**options)),
+                       make_etag(post.etag_parts(), embedded_parts([post], options)))
 
 
 @api.route("/posts/", methods=["POST"])
 @permission_required(Permission.WRITE_ARTICLES)
 def new_post():
     post = Post.from_json(request.json)
-    post.author = g.current_user
+    post.author = User.query.get(g.current_user.id)
     db.session.add(post)
     db.session.commit()
-    return jsonify(post.to_json()), 201, \
+    return serialize(post.to_json()), 201, \
         {"Location": url_for("api.get_post", id=post.id, _external=True)}
 
 
+@api.route("/posts/batch", methods=["POST"])
+@permission_required(Permission.WRITE_ARTICLES)
+def new_posts():
+    """Creates every post in one transaction, or none of them if any is invalid"""
+    posts, results, valid = validate_items(batch_items("posts"), Post.from_json)
+    if not valid:
+        return serialize({"results": results}), 400
+    author = User.query.get(g.current_user.id)
+    for post in posts:
+        post.author = author
+    db.session.add_all(posts)
+    db.session.commit()
+    for post, result in zip(posts, results):
+        result["post"] = post.to_json()
+        result["location"] = url_for("api.get_post", id=post.id, _external=True)
+    return serialize({"results": results}), 201
+
+
 @api.route("/posts/<int:id>", methods=["PUT"])    
 @permission_required(Permission.WRITE_ARTICLES)
 def edit_post(id):
     post = Post.query.get_or_404(id)
     # check of current user would be a good decorator candidate if it gets used more
-    if g.current_user != post.author and \
+    if g.current_user.id != post.author_id and \
             not g.current_user.can(Permission.ADMINISTER):
         return forbidden("Insufficient permissions")
     post.body = request.json.get("body", post.body)
     db.session.add(post)
-    return jsonify(post.to_json())
+    return serialize(post.to_json())
@@ -0,0 +1,32 @@
+from flask import request, url_for, current_app
+from . import api
+from .serializers import serialize
+from .. import search_index
+from ..exceptions import ValidationError
+from ..conditional import conditional, collection_etag
+
+
+@api.route("/search")
+def search():
+    q = request.args.get("q", "").strip()
+    if not q:
+        raise ValidationError("search needs a q parameter")
+    kind = request.args.get("kind")
+    if kind is not None and kind not in ("post", "comment"):
+        raise ValidationError("kind must be post or comment")
+    page = max(request.args.get("page", 1, type=int), 1)
+    results, has_next = search_index.results(
+        q, kind=kind, page=page,
+        per_page=current_app.config["BLOG_SEARCH_RESULTS_PER_PAGE"])
+    prev = None
+    if page > 1:
+        prev = url_for("api.search", q=q, kind=kind, page=page-1, _external=True)
+    next = None
+    if has_next:
+        next = url_for("api.search", q=q, kind=kind, page=page+1, _external=True)
+    return conditional(lambda: serialize({
+        "results": [{"kind": kind, "score": score, kind: row.to_json()}
+                    for kind, row, score in results],
+        "prev": prev,
+        "next": next}),
+        collection_etag([row for kind, row, score in results], prev, next))
@@ -0,0 +1,82 @@
+import json
+from collections import OrderedDict
+from datetime import datetime
+from flask import current_app, request
+from . import api
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+WEEKDAYS = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+MONTHS = ("Jan", "Feb", "Mar", "Apr", "May", "Jun",
+          "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
+
+
+def format_datetime(value):
+    """Same text as werkzeug's http_date (what jsonify produced) for the naive UTC
+    datetimes the models store, without going through a time tuple"""
+    return "%s, %02d %s %d %02d:%02d:%02d GMT" % (
+        WEEKDAYS[value.weekday()], value.day, MONTHS[value.month - 1], value.year,
+        value.hour, value.minute, value.second)
+
+
+def encode_default(value):
+    if isinstance(value, datetime):
+        return format_datetime(value)
+    raise TypeError("%r is not serializable" % (value,))
+
+
+class JSONSerializer(object):
+    """Compact JSON: no indentation, no key sorting, datetimes formatted directly"""
+    mimetype = "application/json"
+
+    def __init__(self):
+        self.encoder = json.JSONEncoder(separators=(",", ":"), default=encode_default)
+
+    def dumps(self, obj):
+        return self.encoder.encode(obj)
+
+
+class MsgpackSerializer(object):
+    mimetype = "application/msgpack"
+
+    def dumps(self, obj):
+        return msgpack.packb(obj, default=encode_default, use_bin_type=True)
+
+
+# Content types the API can answer with, the first one is the default
+SERIALIZERS = OrderedDict()
+
+
+def register_serializer(serializer, *mimetypes):
+    for mimetype in (serializer.mimetype,) + mimetypes:
+        SERIALIZERS[mimetype] = serializer
+
+
+json_serializer = JSONSerializer()
+register_serializer(json_serializer)
+if msgpack is not None:
+    register_serializer(MsgpackSerializer(), "application/x-msgpack")
+
+
+def negotiate():
+    """The serializer for the request's Accept header, JSON when nothing else matches"""
+    default = next(iter(SERIALIZERS))
+    mimetype = request.accept_mimetypes.best_match(list(SERIALIZERS), default=default)
+    return SERIALIZERS[mimetype]
+
+
+def serialize(obj, status=None):
+    """Drop in for jsonify in the API views"""
+    serializer = negotiate()
+    return current_app.response_class(serializer.dumps(obj), status=status,
+                                      mimetype=serializer.mimetype)
+
+
+@api.after_request
+def vary_on_accept(response):
+    # Bodies and ETags depend on Accept, 304s answered before serializing included
+    response.vary.add("Accept")
+    return response
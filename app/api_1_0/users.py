@@ -1,61 +1,88 @@
-from flask import jsonify, request, current_app, url_for
+from flask import request, current_app, stream_with_context
 from . import api
+from .serializers import serialize, json_serializer
 from ..models import User, Post
+from .pagination import paginate
+from .batch import requested_ids, batch_read
+from .fields import json_options, embedded_parts
+from ..conditional import conditional, make_etag, collection_etag
 
 
 @api.route("/users/")
 def get_users():
-    users = User.query.all()
-    return jsonify({"users": [user.to_json() for user in users]})
+    options = json_options(User)
+    if "ids" in request.args:
+        users, results = batch_read(User.query, User, requested_ids(), "user", options)
+        return conditional(lambda: serialize({"results": results}),
+                           collection_etag(users))
+    users, prev, next, count = paginate(
+        User.query, User, "api.get_users", ascending=True, sort_by="member_since",
+        per_page=current_app.config["BLOG_FOLLOWERS_PER_PAGE"])
+    return conditional(lambda: serialize({
+        "users": [user.to_json(**options) for user in users],
+        "prev": prev,
+        "next": next,
+        "count": count}),
+        collection_etag(users, prev, next, count))
+
+
+@api.route("/users/export")
+def export_users():
+    """Every user as newline delimited JSON, read from a server side cursor
+    in chunks so memory use doesn't grow with the table"""
+    chunk_size = current_app.config["BLOG_EXPORT_CHUNK_SIZE"]
+    options = json_options(User)
+
+    def generate():
+        query = User.query.order_by(User.id) \
+            .execution_options(stream_results=True).yield_per(chunk_size)
+        lines = []
+        for user in query:
+            lines.append(json_serializer.dumps(user.to_json(**options)))
+            if len(lines) == chunk_size:
+                yield "\n".join(lines) + "\n"
+                lines = []
+        if lines:
+            yield "\n".join(lines) + "\n"
+
+    return current_app.response_class(stream_with_context(generate()),
+                                      mimetype="application/x-ndjson")
 
 
 @api.route("/users/<int:id>")
 def get_user(id):
+    options = json_options(User)
     user = User.query.get_or_404(id)
-    return jsonify(user.to_json())
+    return conditional(lambda: serialize(user.to_json(**options)),
+                       make_etag(user.etag_parts()))
 
 
 @api.route('/users/<int:id>/posts/')
 def get_user_posts(id):
+    options = json_options(Post)
     user = User.query.get_or_404(id)
-    page = request.args.get('page', 1, type=int)
-    pagination = user.posts.order_by(Post.timestamp.desc()).paginate(
-        page, per_page=current_app.config['BLOG_POSTS_PER_PAGE'],
-        error_out=False)
-    posts = pagination.items
-    prev = None
-    if pagination.has_prev:
-        prev = url_for('api.get_user_posts', page=page-1, _external=True)
-    next = None
-    if pagination.has_next:
-        next = url_for('api.get_user_posts', page=page+1, _external=True)
-    return jsonify({
-        'posts': [post.to_json() for post in posts],
+    posts, prev, next, count = paginate(
+        Post.with_authors(user.posts), Post, 'api.get_user_posts',
+        per_page=current_app.config['BLOG_POSTS_PER_PAGE'], id=id)
+    return conditional(lambda: serialize({
+        'posts': [post.to_json(**options) for post in posts],
         'prev': prev,
         'next': next,
-        'count': pagination.total
-    })
+        'count': count
+    }), collection_etag(posts, prev, next, count, embedded_parts(posts, options)))
 
 
 @api.route('/users/<int:id>/timeline/')
 def get_user_followed_posts(id):
+    options = json_options(Post)
     user = User.query.get_or_404(id)
-    page = request.args.get('page', 1, type=int)
-    pagination = user.followed_posts.order_by(Post.timestamp.desc()).paginate(
-        page, per_page=current_app.config['BLOG_POSTS_PER_PAGE'],
-        error_out=False)
-    posts = pagination.items
-    prev = None
-    if pagination.has_prev:
-        prev = url_for('api.get_user_followed_posts', page=page-1,
-                       _external=True)
-    next = None
-    if pagination.has_next:
-        next = url_for('api.get_user_followed_posts', page=page+1,
-                       _external=True)
-    return jsonify({
-        'posts': [post.to_json() for post in posts],
+    posts, prev, next, count = paginate(
+        Post.with_authors(user.followed_posts), Post,
+        'api.get_user_followed_posts',
+        per_page=current_app.config['BLOG_POSTS_PER_PAGE'], id=id)
+    return conditional(lambda: serialize({
+        'posts': [post.to_json(**options) for post in posts],
         'prev': prev,
         'next': next,
-        'count': pagination.total
-    })
+        'count': count
+    }), collection_etag(posts, prev, next, count, embedded_parts(posts, options)))
@@ -0,0 +1,96 @@
+import hashlib
+import json
+import os
+import re
+from flask import request, url_for
+
+# Copies and derived files that are never fingerprinted themselves
+SKIP_EXTENSIONS = (".gz", ".br")
+MANIFEST_NAME = "manifest.json"
+HASHED_NAME = re.compile(r"^(.*)\.[0-9a-f]{10}(\.[^./]*)?$")
+
+
+def fingerprint(name, data):
+    """styles.css -> styles.<first 10 hex digits of the sha1 of its content>.css"""
+    root, extension = os.path.splitext(name)
+    return "{0}.{1}{2}".format(root, hashlib.sha1(data).hexdigest()[:10], extension)
+
+
+def is_fingerprinted(name, data):
+    """True for a copy written by an earlier build, its name carries its own hash"""
+    match = HASHED_NAME.match(name)
+    return match is not None and fingerprint(match.group(1) + (match.group(2) or ""),
+                                             data) == name
+
+
+def build(static_folder, manifest_path):
+    """Writes a content hashed copy of every static file and a manifest mapping
+    each original name to its copy. Copies from the previous build that are no
+    longer current are removed. Returns the new manifest"""
+    try:
+        with open(manifest_path) as f:
+            previous = json.load(f)
+    except (IOError, OSError, ValueError):
+        previous = {}
+    outputs = set(previous.values())
+    manifest = {}
+    for root, dirs, files in os.walk(static_folder):
+        for filename in files:
+            path = os.path.join(root, filename)
+            name = os.path.relpath(path, static_folder).replace(os.sep, "/")
+            if name.endswith(SKIP_EXTENSIONS) or name == MANIFEST_NAME or name in outputs:
+                continue
+            with open(path, "rb") as f:
+                data = f.read()
+            # the manifest may be gone, copies are recognised by their names too
+            if is_fingerprinted(name, data):
+                continue
+            hashed = fingerprint(name, data)
+            target = os.path.join(static_folder, *hashed.split("/"))
+            if not os.path.exists(target):
+                with open(target, "wb") as f:
+                    f.write(data)
+            manifest[name] = hashed
+    for stale in outputs - set(manifest.values()):
+        for suffix in ("",) + SKIP_EXTENSIONS:
+            path = os.path.join(static_folder, *(stale + suffix).split("/"))
+            if os.path.exists(path):
+                os.remove(path)
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+class Assets(object):
+    """Fingerprinted static URLs from the manifest written by "manage.py build_assets"
+    Templates call asset_url("styles.css"). When the file is in the manifest the URL
+    names the hashed copy, which never changes and is cached for a year. Without a
+    manifest (development) it falls back to the plain static URL"""
+
+    def __init__(self, app=None):
+        self.manifest = {}
+        self.hashed = set()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.load(app.config["BLOG_ASSET_MANIFEST"])
+        app.add_template_global(self.asset_url)
+        app.after_request(self.cache_headers)
+
+    def load(self, path):
+        try:
+            with open(path) as f:
+                self.manifest = json.load(f)
+        except (IOError, OSError, ValueError):
+            self.manifest = {}
+        self.hashed = set(self.manifest.values())
+
+    def asset_url(self, filename, **values):
+        return url_for("static", filename=self.manifest.get(filename, filename), **values)
+
+    def cache_headers(self, response):
+        if request.endpoint == "static" and response.status_code in (200, 304) and \
+                (request.view_args or {}).get("filename") in self.hashed:
+            response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        return response
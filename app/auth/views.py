@@ -1,7 +1,7 @@
 from flask import render_template, redirect, request, url_for, flash
 from flask_login import login_user, login_required, logout_user, current_user
 from . import auth
-from .. import db
+from .. import db, last_seen
 from ..models import User
 from .forms import LoginForm, RegistrationForm, ChangePasswordForm, \
                    PasswordResetRequestForm, PasswordResetForm, ChangeEmailForm
@@ -12,8 +12,9 @@ from ..email import send_email
 def before_request():
     # intercepts users who have not confirmed but can log in, does nothing otherwise
     if current_user.is_authenticated:
-        # This intercepts all requests, so good place to call ping and update last seen
-        current_user.ping()
+        # This intercepts all requests, so good place to update last seen
+        # Buffered and written in batches instead of an UPDATE per request
+        last_seen.touch(current_user.id)
         if not current_user.confirmed \
            and request.endpoint != "static" \
            and request.endpoint[:5] != "auth.":
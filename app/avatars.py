@@ -0,0 +1,101 @@
+import os
+import re
+import struct
+import tempfile
+import zlib
+
+HASH_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+GRID = 5
+
+
+def png(pixels, size):
+    """Encodes rows of (r, g, b) tuples as an 8 bit RGB PNG"""
+    def chunk(kind, data):
+        return (struct.pack(">I", len(data)) + kind + data +
+                struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff))
+    raw = b"".join(b"\x00" + bytes(channel for pixel in row for channel in pixel)
+                   for row in pixels)
+    header = struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0)
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) +
+            chunk(b"IDAT", zlib.compress(raw, 9)) + chunk(b"IEND", b""))
+
+
+def identicon(hash, size):
+    """Draws a horizontally symmetric 5x5 identicon for an md5 hex digest
+    The first bytes pick the colour and the rest switch cells on, so the same
+    hash always produces the same image at any size"""
+    digest = bytes.fromhex(hash)
+    colour = (digest[0] // 2 + 64, digest[1] // 2 + 64, digest[2] // 2 + 64)
+    background = (240, 240, 240)
+    half = (GRID + 1) // 2
+    cells = [[digest[3 + (row * half + col) % 13] % 2 == 0 for col in range(half)]
+             for row in range(GRID)]
+    cells = [row + row[:GRID - half][::-1] for row in cells]
+    margin = size // 10
+    cell = max((size - 2 * margin) // GRID, 1)
+    offset = (size - cell * GRID) // 2
+    background_row = [background] * size
+    rows = []
+    for y in range(size):
+        row_index = (y - offset) // cell
+        if y < offset or row_index >= GRID:
+            rows.append(background_row)
+            continue
+        row = []
+        for x in range(size):
+            col_index = (x - offset) // cell
+            on = x >= offset and col_index < GRID and cells[row_index][col_index]
+            row.append(colour if on else background)
+        rows.append(row)
+    return png(rows, size)
+
+
+class AvatarCache(object):
+    """Serves identicons from a directory on disk, drawing them the first time they are asked for
+    Files are keyed by avatar_hash and size. A new email gives a new hash, so a file never changes.
+    Only the BLOG_AVATAR_SIZES the templates use are drawn, and only for hashes that belong
+    to a user, so the directory can't grow past users x sizes files"""
+
+    def __init__(self, app=None):
+        self.path = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.path = app.config["BLOG_AVATAR_CACHE_DIR"]
+        self.sizes = sorted(app.config["BLOG_AVATAR_SIZES"])
+        os.makedirs(self.path, exist_ok=True)
+
+    def valid(self, hash, size):
+        return bool(HASH_PATTERN.match(hash)) and size in self.sizes
+
+    def size_for(self, size):
+        """The smallest served size that is at least size, or the largest one"""
+        for served in self.sizes:
+            if served >= size:
+                return served
+        return self.sizes[-1]
+
+    def filename(self, hash, size):
+        # Two character subdirectories keep any one directory small
+        return os.path.join(self.path, hash[:2], "{0}-{1}.png".format(hash, size))
+
+    def get(self, hash, size, known):
+        """The PNG for hash, None when it isn't cached yet and known(hash) is false"""
+        filename = self.filename(hash, size)
+        try:
+            with open(filename, "rb") as f:
+                return f.read()
+        except (IOError, OSError):
+            pass
+        if not known(hash):
+            return None
+        data = identicon(hash, size)
+        directory = os.path.dirname(filename)
+        os.makedirs(directory, exist_ok=True)
+        # Write then rename so other workers never read a partial file
+        fd, tmp = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, filename)
+        return data
@@ -0,0 +1,243 @@
+import gzip
+import mimetypes
+import os
+import zlib
+from flask import request, send_from_directory, safe_join
+from werkzeug.datastructures import Headers
+from werkzeug.http import parse_accept_header
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Precompressed siblings written by "manage.py compress_static"
+EXTENSIONS = {"br": ".br", "gzip": ".gz"}
+# Already compressed formats gain nothing
+SKIP_EXTENSIONS = (".gz", ".br", ".png", ".jpg", ".jpeg", ".gif", ".woff", ".woff2")
+
+
+def negotiate(accept_encoding):
+    """The best encoding the client accepts, brotli first, None for identity"""
+    accepted = parse_accept_header(accept_encoding or "")
+    for encoding in ("br", "gzip"):
+        if encoding == "br" and brotli is None:
+            continue
+        if accepted[encoding] > 0 or (encoding == "gzip" and accepted["x-gzip"] > 0):
+            return encoding
+    return None
+
+
+class GzipStream(object):
+    def __init__(self, level):
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data, flush):
+        data = self.compressor.compress(data)
+        if flush:
+            data += self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        return data
+
+    def finish(self):
+        return self.compressor.flush()
+
+
+class BrotliStream(object):
+    def __init__(self, quality):
+        self.compressor = brotli.Compressor(quality=quality)
+        # the method was renamed from process to compress in brotli 1.0
+        self.process = getattr(self.compressor, "process", None) or self.compressor.compress
+
+    def compress(self, data, flush):
+        data = self.process(data)
+        if flush:
+            data += self.compressor.flush()
+        return data
+
+    def finish(self):
+        return self.compressor.finish()
+
+
+class CompressionMiddleware(object):
+    """Gzip or brotli compresses text responses for clients that accept it
+    Bodies with a Content-Length below the threshold are left alone. Streamed bodies
+    are read until they pass the threshold and then compressed chunk by chunk,
+    flushing after each one so a stream still arrives as it is produced.
+    Compressed responses get a weak ETag (the bytes differ from the identity body),
+    and weak validators sent back are stripped before the app compares them"""
+
+    def __init__(self, app, min_size=500, level=6, brotli_quality=4, types=()):
+        self.app = app
+        self.min_size = min_size
+        self.level = level
+        self.brotli_quality = brotli_quality
+        self.types = set(types)
+
+    def __call__(self, environ, start_response):
+        encoding = negotiate(environ.get("HTTP_ACCEPT_ENCODING"))
+        if encoding is None or environ.get("REQUEST_METHOD") == "HEAD":
+            return self.app(environ, start_response)
+        if "HTTP_IF_NONE_MATCH" in environ:
+            # If-None-Match uses weak comparison, so W/"x" matches the app's "x"
+            environ["HTTP_IF_NONE_MATCH"] = environ["HTTP_IF_NONE_MATCH"].replace('W/"', '"')
+
+        captured = []
+
+        def capture(status, headers, exc_info=None):
+            captured[:] = [status, headers, exc_info]
+            return lambda data: None
+
+        app_iter = self.app(environ, capture)
+        status, headers, exc_info = captured
+        headers = Headers(headers)
+        if status.startswith("304"):
+            self.weaken_etag(headers)
+            start_response(status, headers.to_wsgi_list(), exc_info)
+            return app_iter
+        if not self.eligible(status, headers):
+            start_response(status, headers.to_wsgi_list(), exc_info)
+            return app_iter
+
+        iterator = iter(app_iter)
+        buffered = []
+        length = headers.get("Content-Length", type=int)
+        if length is None:
+            # unknown length, look ahead until the body is big enough to be worth it
+            size = 0
+            for chunk in iterator:
+                buffered.append(chunk)
+                size += len(chunk)
+                if size >= self.min_size:
+                    break
+            else:
+                length = size
+        if length is not None and length < self.min_size:
+            start_response(status, headers.to_wsgi_list(), exc_info)
+            return self.chain(buffered, iterator, app_iter)
+
+        streaming = "Content-Length" not in headers
+        headers.remove("Content-Length")
+        headers["Content-Encoding"] = encoding
+        self.add_vary(headers)
+        self.weaken_etag(headers)
+        start_response(status, headers.to_wsgi_list(), exc_info)
+        if encoding == "br":
+            stream = BrotliStream(self.brotli_quality)
+        else:
+            stream = GzipStream(self.level)
+        return self.compress(stream, streaming, buffered, iterator, app_iter)
+
+    def eligible(self, status, headers):
+        if not status.startswith("2") or status.startswith("204"):
+            return False
+        if "Content-Encoding" in headers:
+            return False
+        if "no-transform" in headers.get("Cache-Control", ""):
+            return False
+        mimetype = headers.get("Content-Type", "").split(";")[0].strip()
+        return mimetype in self.types
+
+    @staticmethod
+    def add_vary(headers):
+        vary = headers.get("Vary")
+        headers["Vary"] = vary + ", Accept-Encoding" if vary else "Accept-Encoding"
+
+    @staticmethod
+    def weaken_etag(headers):
+        etag = headers.get("ETag")
+        if etag and not etag.startswith("W/"):
+            headers["ETag"] = "W/" + etag
+
+    @staticmethod
+    def chain(buffered, iterator, app_iter):
+        try:
+            for chunk in buffered:
+                yield chunk
+            for chunk in iterator:
+                yield chunk
+        finally:
+            if hasattr(app_iter, "close"):
+                app_iter.close()
+
+    @staticmethod
+    def compress(stream, streaming, buffered, iterator, app_iter):
+        try:
+            for chunk in buffered:
+                data = stream.compress(chunk, streaming)
+                if data:
+                    yield data
+            for chunk in iterator:
+                data = stream.compress(chunk, streaming)
+                if data:
+                    yield data
+            yield stream.finish()
+        finally:
+            if hasattr(app_iter, "close"):
+                app_iter.close()
+
+
+class Compress(object):
+    """Installs the compression middleware and serves precompressed static files"""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not app.config["BLOG_COMPRESS"]:
+            return
+        app.wsgi_app = CompressionMiddleware(
+            app.wsgi_app, min_size=app.config["BLOG_COMPRESS_MIN_SIZE"],
+            level=app.config["BLOG_COMPRESS_LEVEL"],
+            brotli_quality=app.config["BLOG_COMPRESS_BROTLI_QUALITY"],
+            types=app.config["BLOG_COMPRESS_MIMETYPES"])
+        app.view_functions["static"] = self.static_view(app)
+
+    @staticmethod
+    def static_view(app):
+        send_static_file = app.view_functions["static"]
+
+        def static(filename):
+            encoding = negotiate(request.headers.get("Accept-Encoding"))
+            if encoding is not None:
+                compressed = filename + EXTENSIONS[encoding]
+                if os.path.isfile(safe_join(app.static_folder, compressed)):
+                    response = send_from_directory(
+                        app.static_folder, compressed,
+                        mimetype=mimetypes.guess_type(filename)[0] or "application/octet-stream",
+                        cache_timeout=app.get_send_file_max_age(filename))
+                    response.headers["Content-Encoding"] = encoding
+                    response.vary.add("Accept-Encoding")
+                    return response
+            return send_static_file(filename=filename)
+        return static
+
+
+def precompress(directory):
+    """Writes .gz and .br siblings next to every static file that changed since the last run
+    Done once at build time at the highest levels, so serving them costs no CPU"""
+    written = []
+    for root, dirs, files in os.walk(directory):
+        for name in files:
+            if name.endswith(SKIP_EXTENSIONS):
+                continue
+            path = os.path.join(root, name)
+            with open(path, "rb") as f:
+                data = f.read()
+            outputs = [(path + ".gz", lambda: gzip.compress(data, 9))]
+            if brotli is not None:
+                outputs.append((path + ".br", lambda: brotli.compress(data, quality=11)))
+            for output, compress in outputs:
+                if os.path.exists(output) and \
+                        os.path.getmtime(output) >= os.path.getmtime(path):
+                    continue
+                body = compress()
+                # keep only the ones that actually save something
+                if len(body) >= len(data):
+                    if os.path.exists(output):
+                        os.remove(output)
+                    continue
+                with open(output, "wb") as f:
+                    f.write(body)
+                written.append(output)
+    return written
@@ -0,0 +1,63 @@
+import hashlib
+from flask import current_app, request, make_response, session
+from flask_login import current_user
+
+
+def make_etag(*parts):
+    """Strong ETag from the URL and the versions of the rows a response is built from,
+    so it can be checked before anything is serialized or rendered"""
+    # the API picks JSON or msgpack from the Accept header, so the bytes differ
+    return hashlib.sha1(repr((request.url, request.headers.get("Accept")) + parts)
+                        .encode("utf-8")).hexdigest()
+
+
+def collection_etag(items, *parts):
+    return make_etag([item.etag_parts() for item in items], *parts)
+
+
+def shared_page():
+    """HTML pages only get validators when every viewer sees the same page,
+    logged in users get forms with CSRF tokens and flashed messages"""
+    return not current_user.is_authenticated and "_flashes" not in session
+
+
+def page_etag(*parts):
+    """ETag for an HTML page, None when the page differs between viewers"""
+    if not shared_page():
+        return None
+    return make_etag(*parts)
+
+
+def authored_parts(rows):
+    # list pages also show each author's name and avatar
+    return [row.etag_parts() + ((row.author.username, row.author.avatar_hash)
+                                if row.author else ()) for row in rows]
+
+
+def not_modified(etag, last_modified=None):
+    if request.if_none_match:
+        # If-None-Match takes precedence over If-Modified-Since
+        if not request.if_none_match.contains(etag):
+            return None
+    elif request.if_modified_since and last_modified is not None:
+        if last_modified.replace(microsecond=0) > request.if_modified_since:
+            return None
+    else:
+        return None
+    return current_app.response_class(status=304)
+
+
+def conditional(build, etag, last_modified=None):
+    """Returns a 304 when the client's copy is current, otherwise calls build
+    to make the full response. Both carry the validators.
+    Only pass last_modified when it changes with everything the ETag covers,
+    posts and users have no such timestamp (edits and new comments leave it alone)"""
+    if etag is None:
+        return build()
+    response = not_modified(etag, last_modified)
+    if response is None:
+        response = make_response(build())
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    return response
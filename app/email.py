@@ -1,12 +1,106 @@
-from threading import Thread
+import queue
+import socket
+import smtplib
+import threading
+import time
 from flask import current_app, render_template
 from flask_mail import Message
 from . import mail
 
 
-def send_async_email(app, msg):
-    with app.app_context():
-        mail.send(msg)
+class MailQueue(object):
+    """Bounded outgoing mail queue drained by a fixed pool of worker threads
+    Each worker opens one SMTP connection, sends everything that is waiting on it
+    (up to BLOG_MAIL_BATCH_SIZE messages) and closes it again after the batch.
+    Failed sends are retried with exponential backoff, a message that fails for any
+    other reason is logged and skipped. Workers that died are replaced on the next put.
+    When the queue is full send_email blocks for up to BLOG_MAIL_QUEUE_TIMEOUT seconds
+    before giving up"""
+
+    def __init__(self, app=None):
+        self.queue = None
+        self.workers = []
+        self.lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # running workers keep draining the same queue, they pick up the new app per batch
+        with self.lock:
+            self.app = app
+            if self.queue is None:
+                self.queue = queue.Queue(maxsize=app.config["BLOG_MAIL_QUEUE_SIZE"])
+
+    def start(self):
+        with self.lock:
+            self.workers = [worker for worker in self.workers if worker.is_alive()]
+            for i in range(len(self.workers), self.app.config["BLOG_MAIL_WORKERS"]):
+                worker = threading.Thread(target=self.work, name="mail-%d" % i)
+                worker.daemon = True
+                worker.start()
+                self.workers.append(worker)
+
+    def put(self, msg):
+        self.start()
+        try:
+            self.queue.put(msg, timeout=self.app.config["BLOG_MAIL_QUEUE_TIMEOUT"])
+            return True
+        except queue.Full:
+            self.app.logger.error("Mail queue full, dropped message to %s" % msg.recipients)
+            return False
+
+    def work(self):
+        while True:
+            batch = [self.queue.get()]
+            size = 1
+            try:
+                app = self.app
+                # gather whatever else is already waiting, up to a batch
+                while len(batch) < app.config["BLOG_MAIL_BATCH_SIZE"]:
+                    try:
+                        batch.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+                size = len(batch)
+                with app.app_context():
+                    self.send_batch(app, batch)
+            except Exception:
+                self.app.logger.exception("Mail worker could not send %d messages" % size)
+            finally:
+                # join() must not wait on messages that were dropped
+                for i in range(size):
+                    self.queue.task_done()
+
+    @staticmethod
+    def send_batch(app, batch):
+        retries = app.config["BLOG_MAIL_RETRIES"]
+        delay = app.config["BLOG_MAIL_RETRY_DELAY"]
+        for attempt in range(retries + 1):
+            try:
+                # one connection (and one TLS handshake) for the whole batch
+                with mail.connect() as conn:
+                    while batch:
+                        msg = batch[0]
+                        try:
+                            conn.send(msg)
+                        except (smtplib.SMTPException, socket.error):
+                            raise
+                        except Exception:
+                            app.logger.exception("Could not send message to %s" % msg.recipients)
+                        batch.pop(0)
+                return
+            except (smtplib.SMTPException, socket.error) as e:
+                if attempt == retries:
+                    app.logger.error("Could not send %d messages: %s" % (len(batch), e))
+                    return
+                time.sleep(delay * 2 ** attempt)
+
+    def join(self):
+        """Waits until every queued message has been handled"""
+        self.queue.join()
+
+
+mail_queue = MailQueue()
 
 
 def send_email(to, subject, template, **kwargs):
@@ -15,6 +109,4 @@ def send_email(to, subject, template, **kwargs):
                   sender=app.config['BLOG_MAIL_SENDER'], recipients=[to])
     msg.body = render_template(template + '.txt', **kwargs)
     msg.html = render_template(template + '.html', **kwargs)
-    thr = Thread(target=send_async_email, args=[app, msg])
-    thr.start()
-    return thr
+    return mail_queue.put(msg)
@@ -0,0 +1,135 @@
+import glob
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from flask import request
+from flask_login import current_user
+from jinja2 import Markup
+
+
+class MemoryBackend(object):
+    """LRU dict private to each worker process"""
+
+    def __init__(self, maxsize=2048):
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def delete_prefix(self, prefix):
+        with self.lock:
+            for key in [key for key in self.entries if key.startswith(prefix)]:
+                del self.entries[key]
+
+
+class FileSystemBackend(object):
+    """One file per fragment in a local directory, shared by every worker on the host"""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def filename(self, key):
+        return os.path.join(self.path, key.replace(":", "-") + ".html")
+
+    def get(self, key):
+        try:
+            with open(self.filename(key), encoding="utf-8") as f:
+                return f.read()
+        except (IOError, OSError):
+            return None
+
+    def set(self, key, value):
+        # Write then rename so other workers never read a partial file
+        fd, tmp = tempfile.mkstemp(dir=self.path)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(value)
+        os.replace(tmp, self.filename(key))
+
+    def delete_prefix(self, prefix):
+        for filename in glob.glob(self.filename(prefix + "*")):
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+
+
+class FragmentCache(object):
+    """Caches the rendered HTML of single posts and comments in list templates
+    Keys hold the row's version, which the model events bump on every change,
+    so a stale fragment is never served. Invalidation also drops the old entries"""
+
+    def __init__(self, app=None):
+        self.backend = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        backend = app.config.get("BLOG_FRAGMENT_CACHE")
+        if backend == "memory":
+            self.backend = MemoryBackend(app.config["BLOG_FRAGMENT_CACHE_SIZE"])
+        elif backend == "filesystem":
+            self.backend = FileSystemBackend(app.config["BLOG_FRAGMENT_CACHE_DIR"])
+        elif backend is None:
+            self.backend = None
+        else:
+            raise ValueError("Unknown fragment cache backend %r" % backend)
+
+    @staticmethod
+    def key(kind, id, *parts):
+        digest = hashlib.sha1("|".join(str(part) for part in parts).encode("utf-8"))
+        return "{0}:{1}:{2}".format(kind, id, digest.hexdigest())
+
+    def get(self, key):
+        if self.backend is None:
+            return None
+        value = self.backend.get(key)
+        return Markup(value) if value is not None else None
+
+    def set(self, key, value):
+        """Stores the fragment and returns it so templates can output it directly"""
+        if self.backend is not None:
+            self.backend.set(key, str(value))
+        return Markup(value)
+
+    def invalidate(self, kind, id):
+        if self.backend is not None and id is not None:
+            self.backend.delete_prefix("{0}:{1}:".format(kind, id))
+
+
+def viewer_class(post):
+    """The only viewer dependent part of a post is the edit link"""
+    if current_user.is_authenticated and current_user.id == post.author_id:
+        return "author"
+    if current_user.is_administrator():
+        return "admin"
+    return "reader"
+
+
+def post_fragment_key(post):
+    author = post.author
+    return FragmentCache.key("post", post.id, post.version, viewer_class(post),
+                             request.scheme, author.username if author else None,
+                             author.avatar_hash if author else None)
+
+
+def comment_fragment_key(comment):
+    author = comment.author
+    return FragmentCache.key("comment", comment.id, comment.version, request.scheme,
+                             author.username if author else None,
+                             author.avatar_hash if author else None)
@@ -0,0 +1,40 @@
+from werkzeug.security import generate_password_hash, check_password_hash
+
+try:
+    from gevent import monkey
+    from gevent.threadpool import ThreadPool
+except ImportError:
+    monkey = None
+
+
+class HashPool(object):
+    """Runs password hashing on native threads when serving under gevent
+    PBKDF2 is pure CPU work, run inline it stalls every other greenlet in the worker
+    until it finishes. hashlib releases the GIL while it works, so a native thread pool
+    lets the event loop keep serving requests. Without gevent hashing runs inline.
+    Handing work to a thread costs more than Werkzeug's default 1000 PBKDF2 rounds,
+    see benchmarks/login_burst.py, so the pool is off unless BLOG_HASH_POOL_SIZE is set"""
+
+    def __init__(self, app=None):
+        self.pool = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        size = app.config["BLOG_HASH_POOL_SIZE"]
+        if size and monkey is not None and monkey.is_module_patched("threading"):
+            self.pool = ThreadPool(size)
+        else:
+            self.pool = None
+
+    def run(self, f, *args):
+        if self.pool is None:
+            return f(*args)
+        # the calling greenlet waits, the others keep running
+        return self.pool.apply(f, args)
+
+    def generate_password_hash(self, password):
+        return self.run(generate_password_hash, password)
+
+    def check_password_hash(self, password_hash, password):
+        return self.run(check_password_hash, password_hash, password)
@@ -0,0 +1,87 @@
+from flask import current_app
+from . import db
+from .models import Post, Comment, Follow, Timeline, User
+
+# Queries run on (almost) every page view. manage.py explain checks their plans
+HOT_QUERIES = []
+
+
+def hot_query(f):
+    HOT_QUERIES.append(f)
+    return f
+
+
+@hot_query
+def index_posts():
+    return Post.with_authors(Post.query).order_by(Post.timestamp.desc()) \
+        .limit(current_app.config["BLOG_POSTS_PER_PAGE"])
+
+
+@hot_query
+def user_posts():
+    return Post.with_authors(Post.query.filter_by(author_id=1)) \
+        .order_by(Post.timestamp.desc()) \
+        .limit(current_app.config["BLOG_POSTS_PER_PAGE"])
+
+
+@hot_query
+def followed_posts():
+    return Post.with_authors(Timeline.posts(1)).order_by(Post.timestamp.desc()) \
+        .limit(current_app.config["BLOG_POSTS_PER_PAGE"])
+
+
+@hot_query
+def api_users():
+    return User.query.order_by(User.member_since.asc(), User.id.asc()) \
+        .limit(current_app.config["BLOG_FOLLOWERS_PER_PAGE"])
+
+
+@hot_query
+def followers():
+    return Follow.query.filter_by(followed_id=1).order_by(Follow.timestamp) \
+        .limit(current_app.config["BLOG_FOLLOWERS_PER_PAGE"])
+
+
+@hot_query
+def post_comments():
+    return Comment.with_authors(Comment.query.filter_by(post_id=1)) \
+        .order_by(Comment.timestamp.asc()) \
+        .limit(current_app.config["BLOG_COMMENTS_PER_PAGE"])
+
+
+@hot_query
+def moderate_comments():
+    return Comment.with_authors(Comment.query).order_by(Comment.timestamp.desc()) \
+        .limit(current_app.config["BLOG_COMMENTS_PER_PAGE"])
+
+
+def explain(query):
+    """Runs EXPLAIN for the query on the configured database
+    Returns the plan rows and a list of the full table scans found in it"""
+    connection = db.session.connection()
+    dialect = connection.dialect
+    compiled = query.statement.compile(dialect=dialect)
+    if compiled.positional:
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+    else:
+        params = compiled.params
+    if dialect.name == "sqlite":
+        rows = connection.execute("EXPLAIN QUERY PLAN " + str(compiled), params).fetchall()
+        # the detail text is the last column in every SQLite version
+        plan = [row[-1] for row in rows]
+        # Reading back a subquery's result (SCAN anon_1, SCAN SUBQUERY 1) is not a table scan,
+        # the tables inside it have plan rows of their own
+        subqueries = set(detail.split(" ", 1)[1] for detail in plan
+                         if detail.startswith(("CO-ROUTINE ", "MATERIALIZE ")))
+        scans = [detail for detail in plan
+                 if detail.startswith("SCAN") and "INDEX" not in detail and
+                 not detail.startswith("SCAN SUBQUERY") and
+                 detail.split(" ")[1] not in subqueries]
+    elif dialect.name == "mysql":
+        rows = connection.execute("EXPLAIN " + str(compiled), params).fetchall()
+        plan = ["{table}: type={type} key={key} rows={rows} {Extra}".format(**dict(row.items()))
+                for row in rows]
+        scans = [line for row, line in zip(rows, plan) if row["type"] == "ALL"]
+    else:
+        raise ValueError("EXPLAIN is not supported for %s" % dialect.name)
+    return plan, scans
@@ -0,0 +1,117 @@
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+
+
+class IdentityCache(object):
+    """Per-worker cache of the logged in users' rows and of the roles table
+    load_user rebuilds current_user from the cached column values and merges it into
+    the request's session without a query, with its role attached so can() doesn't
+    lazy load it either. Entries live for BLOG_IDENTITY_CACHE_TTL seconds and at most
+    BLOG_IDENTITY_CACHE_SIZE are kept. They are stored in expiry order, so expired ones
+    are dropped from the front and the next to expire goes first when the cache is full.
+    Committed changes to a user bump its version and drop the entry, and a load that
+    raced with a change is not cached. Roles are read once and reloaded when a
+    role's permissions change"""
+
+    def __init__(self, app=None):
+        self.lock = threading.Lock()
+        self.users = OrderedDict()
+        self.versions = OrderedDict()
+        # versions come from one counter so a forgotten version never matches a new one
+        self.generation = 0
+        self.roles = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.ttl = app.config["BLOG_IDENTITY_CACHE_TTL"]
+        self.maxsize = app.config["BLOG_IDENTITY_CACHE_SIZE"]
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.users.clear()
+            self.versions.clear()
+            self.roles = None
+
+    @staticmethod
+    def snapshot(instance):
+        return dict((attr.key, getattr(instance, attr.key))
+                    for attr in instance.__mapper__.column_attrs)
+
+    @staticmethod
+    def build(model, values):
+        """Persistent instance in the current session made from cached column values"""
+        from . import db
+        instance = model.__mapper__.class_manager.new_instance()
+        for key, value in values.items():
+            set_committed_value(instance, key, value)
+        make_transient_to_detached(instance)
+        return db.session.merge(instance, load=False)
+
+    def role(self, role_id):
+        from .models import Role
+        if role_id is None:
+            return None
+        roles = self.roles
+        if roles is None or role_id not in roles:
+            roles = dict((role.id, self.snapshot(role)) for role in Role.query.all())
+            with self.lock:
+                self.roles = roles
+        values = roles.get(role_id)
+        return self.build(Role, values) if values is not None else None
+
+    def load_user(self, user_id):
+        from .models import User
+        now = time.time()
+        with self.lock:
+            entry = self.users.get(user_id)
+            version = self.versions.get(user_id, 0)
+        if entry is not None and entry[0] > now:
+            user = self.build(User, entry[1])
+            set_committed_value(user, "role", self.role(user.role_id))
+            return user
+        user = User.query.get(user_id)
+        if user is None:
+            return None
+        with self.lock:
+            # a change committed while this one was loading makes it stale
+            if self.versions.get(user_id, 0) == version:
+                self.users.pop(user_id, None)
+                self.users[user_id] = (now + self.ttl, self.snapshot(user))
+                self.prune(now)
+        return user
+
+    def prune(self, now):
+        # caller holds the lock
+        while self.users:
+            user_id, (expires, values) = next(iter(self.users.items()))
+            if expires > now and len(self.users) <= self.maxsize:
+                break
+            del self.users[user_id]
+        while len(self.versions) > self.maxsize:
+            self.versions.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self.lock:
+            self.generation += 1
+            self.versions.pop(user_id, None)
+            self.versions[user_id] = self.generation
+            self.users.pop(user_id, None)
+
+    # Session event hooks, the models record which users and roles changed in session.info
+    def on_commit(self, session):
+        changes = session.info.pop("identity_cache_changes", set())
+        if None in changes:
+            with self.lock:
+                self.roles = None
+            changes.discard(None)
+        for user_id in changes:
+            self.invalidate(user_id)
+
+    @staticmethod
+    def on_rollback(session, previous_transaction):
+        session.info.pop("identity_cache_changes", None)
@@ -0,0 +1,87 @@
+import atexit
+import threading
+import time
+from datetime import datetime
+
+
+class LastSeenBuffer(object):
+    """Buffers last_seen timestamps in memory and writes them in one batched UPDATE
+    A user is recorded at most once every BLOG_LAST_SEEN_RESOLUTION seconds, and the buffer
+    is written every BLOG_LAST_SEEN_FLUSH_INTERVAL seconds and when the worker exits.
+    Written rows stay buffered until the request's transaction commits, so a rollback
+    leaves them for the next flush"""
+
+    def __init__(self, app=None):
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.recorded = {}
+        self.last_flush = time.time()
+        self.app = None
+        atexit.register(self.flush_on_exit)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.interval = app.config["BLOG_LAST_SEEN_FLUSH_INTERVAL"]
+        self.resolution = app.config["BLOG_LAST_SEEN_RESOLUTION"]
+        with self.lock:
+            self.pending.clear()
+            self.recorded.clear()
+        app.after_request(self.after_request)
+
+    def touch(self, user_id):
+        now = time.time()
+        with self.lock:
+            if now - self.recorded.get(user_id, 0) < self.resolution:
+                return
+            self.recorded[user_id] = now
+            self.pending[user_id] = datetime.utcnow()
+
+    def after_request(self, response):
+        if time.time() - self.last_flush >= self.interval:
+            self.flush()
+        return response
+
+    def flush(self):
+        """Adds the UPDATE to the current session, committed along with the request"""
+        from . import db
+        from .models import User
+        now = time.time()
+        with self.lock:
+            written = dict(self.pending)
+            self.last_flush = now
+            # users not seen within the resolution would be recorded again anyway
+            self.recorded = dict((user_id, recorded) for user_id, recorded
+                                 in self.recorded.items() if now - recorded < self.resolution)
+        if not written:
+            return
+        users = User.__table__
+        db.session.execute(users.update().where(users.c.id == db.bindparam("user_id"))
+                           .values(last_seen=db.bindparam("last_seen")),
+                           [{"user_id": user_id, "last_seen": last_seen}
+                            for user_id, last_seen in written.items()])
+        db.session.info.setdefault("last_seen_written", {}).update(written)
+
+    # Session event hooks, flush records the rows it wrote in session.info
+    def on_commit(self, session):
+        written = session.info.pop("last_seen_written", None)
+        if not written:
+            return
+        with self.lock:
+            for user_id, last_seen in written.items():
+                # a newer timestamp buffered since the flush still has to be written
+                if self.pending.get(user_id) == last_seen:
+                    del self.pending[user_id]
+
+    @staticmethod
+    def on_rollback(session, previous_transaction):
+        session.info.pop("last_seen_written", None)
+
+    def flush_on_exit(self):
+        if self.app is None or not self.pending:
+            return
+        from . import db
+        with self.app.app_context():
+            self.flush()
+            db.session.commit()
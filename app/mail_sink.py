@@ -0,0 +1,69 @@
+import socketserver
+import threading
+import time
+
+
+class SinkHandler(socketserver.StreamRequestHandler):
+    """Speaks just enough SMTP for smtplib: greeting, EHLO/HELO, MAIL, RCPT, DATA, RSET, QUIT"""
+
+    def reply(self, line):
+        self.wfile.write((line + "\r\n").encode("ascii"))
+
+    def handle(self):
+        self.reply("220 %s mail sink ready" % self.server.server_address[0])
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode("ascii", "replace").strip().split(" ", 1)[0].upper()
+            if command == "EHLO":
+                self.reply("250-%s" % self.server.server_address[0])
+                self.reply("250 8BITMIME")
+            elif command in ("HELO", "MAIL", "RCPT", "RSET", "NOOP"):
+                self.reply("250 OK")
+            elif command == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                while True:
+                    line = self.rfile.readline()
+                    if not line or line.rstrip(b"\r\n") == b".":
+                        break
+                self.server.process_message()
+                self.reply("250 OK")
+            elif command == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+
+class SinkServer(socketserver.ThreadingTCPServer):
+    """Local SMTP stand-in that accepts and counts messages without delivering them
+    Point MAIL_SERVER/MAIL_PORT at it (with MAIL_USE_TLS off) to test mail throughput offline
+    Built on socketserver since smtpd and asyncore are gone from Python 3.12"""
+    daemon_threads = True
+    allow_reuse_address = True
+    # the thread per message benchmark connects all at once
+    request_queue_size = 128
+
+    def __init__(self, host="localhost", port=1025):
+        socketserver.ThreadingTCPServer.__init__(self, (host, port), SinkHandler)
+        self.lock = threading.Lock()
+        self.count = 0
+        self.started = None
+
+    def process_message(self):
+        with self.lock:
+            if self.started is None:
+                self.started = time.time()
+            self.count += 1
+
+    def rate(self):
+        if not self.started:
+            return 0.0
+        return self.count / max(time.time() - self.started, 1e-6)
+
+    def serve_in_thread(self):
+        thread = threading.Thread(target=self.serve_forever, kwargs={"poll_interval": 0.1})
+        thread.daemon = True
+        thread.start()
+        return thread
@@ -11,9 +11,17 @@ main = Blueprint("main", __name__)
 ## must import them after the bp instance is created to avoid circular import
 from . import views, errors
 from ..models import Permission
+from .. import fragment_cache
+from ..fragments import post_fragment_key, comment_fragment_key
 
 
 # Context processors can be used to make variables available globally to all templates
 @main.app_context_processor
 def inject_permissions():
     return dict(Permission=Permission)
+
+
+@main.app_context_processor
+def inject_fragment_cache():
+    return dict(fragment_cache=fragment_cache, post_fragment_key=post_fragment_key,
+                comment_fragment_key=comment_fragment_key)
@@ -1,29 +1,36 @@
 from flask import render_template, session, redirect, url_for, \
                     current_app, abort, flash, request, make_response
 from flask_login import login_required, current_user 
-from flask_sqlalchemy import get_debug_queries
 from . import main
 from .forms import EditProfileForm, EditProfileAdminForm, PostForm, CommentForm
-from .. import db
+from .. import db, page_cache, avatar_cache, search_index
+from ..conditional import conditional, page_etag, authored_parts
 from ..models import User, Role, Post, Permission, Follow, Comment
 from ..decorators import admin_required, permission_required
 
 
-@main.after_app_request
-def after_request(response):
-    for query in get_debug_queries():
-        if query.duration >= current_app.config["SLOW_DB_QUERY_TIME"]:
-            current_app.logger.warning(
-                "Slow query: %s\nParameters: %s\nDuration: %fs\nContext: %s\n" %
-                (query.statement, query.parameters, query.duration, query.context))
-    return response
-    
-
 @main.route("/_ah/health")
 def health_check():
     return make_response("success", 200)
 
 
+@main.route("/avatar/<hash>/<int:size>")
+def avatar(hash, size):
+    if not avatar_cache.valid(hash, size):
+        abort(404)
+    def build():
+        data = avatar_cache.get(hash, size, User.has_avatar_hash)
+        if data is None:
+            abort(404)
+        response = make_response(data)
+        response.mimetype = "image/png"
+        return response
+    response = conditional(build, "{0}-{1}".format(hash, size))
+    # The image for a hash never changes, browsers and proxies can keep it forever
+    response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    return response
+
+
 @main.route("/shutdown")
 def server_shutdown():
     # checks if current app is running in the testing environment
@@ -43,6 +50,7 @@ def api_test():
 
 # Important to remember route decorator comes from the bp not app
 @main.route("/", methods=["GET", "POST"])
+@page_cache.cached
 def index():
     form = PostForm()
     if current_user.can(Permission.WRITE_ARTICLES) and \
@@ -68,22 +76,31 @@ def index():
     # Setting error out to False returns an empty list instead
     # Object of paginate class is returned by paginate method
     #   has properties good for generating links in template, so it is passed as an arg
-    pagination = query.order_by(Post.timestamp.desc()).paginate(
+    pagination = Post.with_authors(query).order_by(Post.timestamp.desc()).paginate(
             page, per_page=current_app.config["BLOG_POSTS_PER_PAGE"],
             error_out=False)
     posts = pagination.items
-    return render_template("index.html", form=form, posts=posts,
-                           show_followed=show_followed, pagination=pagination)                                
+    page_cache.tag("front page", *[tag for post in posts for tag in post.cache_tags()])
+    return conditional(
+        lambda: render_template("index.html", form=form, posts=posts,
+                                show_followed=show_followed, pagination=pagination),
+        page_etag(authored_parts(posts), pagination.pages))
 
 
 @main.route("/user/<username>")
+@page_cache.cached
 def user(username):
     user = User.query.filter_by(username=username).first()
     if user is None:
         abort(404)
     # Posts is a query object (dynamic loading) so filters and order by can be used
-    posts = user.posts.order_by(Post.timestamp.desc()).all()
-    return render_template("user.html", user=user, posts=posts)
+    posts = Post.with_authors(user.posts).order_by(Post.timestamp.desc()).all()
+    page_cache.tag(*user.cache_tags())
+    page_cache.tag(*["post:%d" % post.id for post in posts])
+    return conditional(
+        lambda: render_template("user.html", user=user, posts=posts),
+        page_etag(user.etag_parts(), user.about_me, user.name, user.location,
+                  authored_parts(posts)))
 
 
 @main.route("/edit-profile", methods=["GET", "POST"])
@@ -131,6 +148,7 @@ def edit_profile_admin(id):
 
 
 @main.route("/post/<int:id>", methods=["GET", "POST"])
+@page_cache.cached
 def post(id):
     post = Post.query.get_or_404(id)
     form = CommentForm()
@@ -147,15 +165,20 @@ def post(id):
     # special page of -1 means get the last page of comments
     # Calculation is done to determine actual page number to use based on number of comments
     if page == -1:
-        page = (post.comments.count() - 1) // \
+        page = (post.comment_count - 1) // \
                 current_app.config["BLOG_COMMENTS_PER_PAGE"] + 1
     # sorting by asc puts new comments at the bottom of the list (usual behavior of comment lists)
-    pagination = post.comments.order_by(Comment.timestamp.asc()).paginate(
+    pagination = Comment.with_authors(post.comments).order_by(Comment.timestamp.asc()).paginate(
         page, per_page=current_app.config["BLOG_COMMENTS_PER_PAGE"], 
         error_out=False)
     comments = pagination.items
-    return render_template("post.html", posts=[post], form=form,
-                           comments=comments, pagination=pagination)
+    page_cache.tag("post:%d" % post.id, "author:%d" % post.author_id)
+    page_cache.tag(*["author:%d" % comment.author_id for comment in comments
+                     if comment.author_id is not None])
+    return conditional(
+        lambda: render_template("post.html", posts=[post], form=form,
+                                comments=comments, pagination=pagination),
+        page_etag(authored_parts([post] + comments), pagination.pages))
 
 
 @main.route("/edit/<int:id>", methods=["GET", "POST"])
@@ -253,12 +276,28 @@ def show_followed():
     return resp
 
 
+@main.route("/search")
+def search():
+    q = request.args.get("q", "").strip()
+    kind = request.args.get("kind")
+    if kind not in ("post", "comment"):
+        kind = None
+    page = max(request.args.get("page", 1, type=int), 1)
+    results, has_next = [], False
+    if q:
+        results, has_next = search_index.results(
+            q, kind=kind, page=page,
+            per_page=current_app.config["BLOG_SEARCH_RESULTS_PER_PAGE"])
+    return render_template("search.html", q=q, kind=kind, page=page,
+                           results=results, has_next=has_next)
+
+
 @main.route("/moderate")
 @login_required
 @permission_required(Permission.MODERATE_COMMENTS)
 def moderate():
     page = request.args.get("page", 1, type=int)
-    pagination = Comment.query.order_by(Comment.timestamp.desc()).paginate(
+    pagination = Comment.with_authors(Comment.query).order_by(Comment.timestamp.desc()).paginate(
         page, per_page=current_app.config["BLOG_COMMENTS_PER_PAGE"],
         error_out=False)
     comments = pagination.items
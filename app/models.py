@@ -1,15 +1,35 @@
 from datetime import datetime
-import bleach
 import hashlib
 from flask import current_app, request, url_for
-from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
-from markdown import markdown
-from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin, AnonymousUserMixin
-from . import db, login_manager
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.util import identity_key
+from . import db, login_manager, render_cache, fragment_cache, page_cache, token_cache, \
+    hash_pool, identity_cache, search_index, avatar_cache, last_seen as last_seen_buffer
+from .render import RENDERER_VERSION
+from .url_templates import external_url
+from .search import fts5_available, CREATE_FTS, DROP_FTS
 from app.exceptions import ValidationError
 
 
+def adjust_counter(connection, model, id, column, delta):
+    """Updates a denormalized counter inside the flush that added or removed the row
+    The UPDATE is relative so concurrent transactions can't lose increments"""
+    if id is None:
+        return
+    table = model.__table__
+    connection.execute(table.update().where(table.c.id == id)
+                       .values({column: table.c[column] + delta}))
+    # Keep an already loaded instance in step with the row without marking it dirty
+    instance = db.session.identity_map.get(identity_key(model, id))
+    if instance is not None and instance.__dict__.get(column) is not None:
+        set_committed_value(instance, column, instance.__dict__[column] + delta)
+    # The counters are part of the cached user snapshots
+    if model is User:
+        db.session.info.setdefault("identity_cache_changes", set()).add(id)
+
+
 # SQLAlchemy provides a baseclass with a set of helper functions to inherit
 class Role(db.Model):
     # Tablename is optional but convention uses plurals as table names so good practice to have
@@ -55,6 +75,143 @@ class Follow(db.Model):
     followed_id = db.Column(db.Integer, db.ForeignKey("users.id"),
                             primary_key=True)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    # The primary key covers lookups by follower, followers of a user need their own index
+    __table_args__ = (db.Index("ix_follows_followed_id_follower_id",
+                               "followed_id", "follower_id"),)
+
+    def cache_tags(self):
+        return ["author:%d" % self.follower_id, "author:%d" % self.followed_id]
+
+    @staticmethod
+    def on_inserted(mapper, connection, target):
+        """Backfills the follower's timeline with the followed user's recent posts"""
+        adjust_counter(connection, User, target.follower_id, "followed_count", 1)
+        adjust_counter(connection, User, target.followed_id, "follower_count", 1)
+        if Timeline.is_heavy_author(connection, target.followed_id):
+            # Posts from heavy authors are read straight from the posts table
+            return
+        follows = Follow.__table__
+        posts = Post.__table__
+        recent_posts = db.select([follows.c.follower_id, posts.c.id, posts.c.timestamp]) \
+            .where(follows.c.follower_id == target.follower_id) \
+            .where(follows.c.followed_id == target.followed_id) \
+            .where(posts.c.author_id == follows.c.followed_id) \
+            .order_by(posts.c.timestamp.desc()) \
+            .limit(current_app.config["BLOG_TIMELINE_BACKFILL"])
+        connection.execute(Timeline.__table__.insert().from_select(
+            ["owner_id", "post_id", "timestamp"], recent_posts))
+
+    @staticmethod
+    def on_deleted(mapper, connection, target):
+        """Trims the followed user's posts out of the follower's timeline"""
+        adjust_counter(connection, User, target.follower_id, "followed_count", -1)
+        adjust_counter(connection, User, target.followed_id, "follower_count", -1)
+        timelines = Timeline.__table__
+        posts = Post.__table__
+        connection.execute(timelines.delete()
+                           .where(timelines.c.owner_id == target.follower_id)
+                           .where(timelines.c.post_id.in_(
+                               db.select([posts.c.id])
+                               .where(posts.c.author_id == target.followed_id))))
+        if Timeline.is_back_under_limit(connection, target.followed_id):
+            Timeline.backfill(connection, target.followed_id)
+
+db.event.listen(Follow, "after_insert", Follow.on_inserted)
+db.event.listen(Follow, "after_delete", Follow.on_deleted)
+
+
+# Inverted index used for search when SQLite FTS5 isn't available, one row per term per document
+class SearchTerm(db.Model):
+    __tablename__ = "search_terms"
+    term = db.Column(db.String(64), primary_key=True)
+    kind = db.Column(db.String(8), primary_key=True)
+    doc_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    count = db.Column(db.Integer)
+    __table_args__ = (db.Index("ix_search_terms_kind_doc_id", "kind", "doc_id"),)
+
+# The FTS5 table is created and dropped alongside search_terms where SQLite supports it
+db.event.listen(SearchTerm.__table__, "after_create",
+                db.DDL(CREATE_FTS).execute_if(callable_=fts5_available))
+db.event.listen(SearchTerm.__table__, "before_drop",
+                db.DDL(DROP_FTS).execute_if(dialect="sqlite"))
+
+
+def project(obj, getters, fields=None):
+    """Builds a to_json dict from (name -> getter) pairs, calling only the getters
+    of the requested fields, or all of them when fields is None"""
+    if fields is None:
+        return {name: getter(obj) for name, getter in getters.items()}
+    unknown = set(fields) - set(getters)
+    if unknown:
+        raise ValidationError("unknown fields: %s" % ", ".join(sorted(unknown)))
+    return {name: getters[name](obj) for name in fields}
+
+
+# Materialized timeline, one row per post per follower (fan-out on write)
+# Replaces joining posts against follows every time the followed posts are requested
+class Timeline(db.Model):
+    __tablename__ = "timelines"
+    owner_id = db.Column(db.Integer, db.ForeignKey("users.id"),
+                         primary_key=True)
+    post_id = db.Column(db.Integer, db.ForeignKey("posts.id"),
+                        primary_key=True)
+    timestamp = db.Column(db.DateTime)
+    __table_args__ = (db.Index("ix_timelines_owner_id_timestamp",
+                               "owner_id", "timestamp"),)
+
+    @staticmethod
+    def is_heavy_author(connection, author_id):
+        """Authors with more followers than the fan-out limit are not copied into timelines,
+        otherwise a single post from them would insert a row for every follower"""
+        users = User.__table__
+        follower_count = connection.scalar(
+            db.select([users.c.follower_count]).where(users.c.id == author_id))
+        return (follower_count or 0) > current_app.config["BLOG_TIMELINE_FANOUT_LIMIT"]
+
+    @staticmethod
+    def is_back_under_limit(connection, author_id):
+        """True when the author has just dropped from heavy back to the fan-out limit"""
+        users = User.__table__
+        follower_count = connection.scalar(
+            db.select([users.c.follower_count]).where(users.c.id == author_id))
+        return follower_count == current_app.config["BLOG_TIMELINE_FANOUT_LIMIT"]
+
+    @staticmethod
+    def backfill(connection, author_id):
+        """Copies the author's recent posts into the timelines of all their followers,
+        so posts written while the author was heavy are still found once they are not"""
+        follows = Follow.__table__
+        posts = Post.__table__
+        timelines = Timeline.__table__
+        recent_posts = db.select([posts.c.id]) \
+            .where(posts.c.author_id == author_id) \
+            .order_by(posts.c.timestamp.desc()) \
+            .limit(current_app.config["BLOG_TIMELINE_BACKFILL"])
+        # Rows fanned out before the author became heavy are still there
+        missing = db.select([follows.c.follower_id, posts.c.id, posts.c.timestamp]) \
+            .where(follows.c.followed_id == author_id) \
+            .where(posts.c.id.in_(recent_posts)) \
+            .where(~db.exists().where(timelines.c.owner_id == follows.c.follower_id)
+                   .where(timelines.c.post_id == posts.c.id))
+        connection.execute(timelines.insert().from_select(
+            ["owner_id", "post_id", "timestamp"], missing))
+
+    @staticmethod
+    def heavy_authors(user_id):
+        """Query of the ids of heavy authors the user follows (fan-out on read)"""
+        return db.session.query(Follow.followed_id) \
+            .join(User, User.id == Follow.followed_id) \
+            .filter(Follow.follower_id == user_id) \
+            .filter(User.follower_count > current_app.config["BLOG_TIMELINE_FANOUT_LIMIT"])
+
+    @staticmethod
+    def posts(user_id):
+        # Posts fanned out into the timeline, plus posts from heavy authors that were not
+        # Union removes duplicates left over from before an author became heavy
+        timeline = Post.query.join(Timeline, Timeline.post_id == Post.id) \
+            .filter(Timeline.owner_id == user_id)
+        heavy = Post.query.filter(Post.author_id.in_(Timeline.heavy_authors(user_id)))
+        return timeline.union(heavy)
 
 
 class User(UserMixin, db.Model):
@@ -63,25 +220,32 @@ class User(UserMixin, db.Model):
     name = db.Column(db.String(64))
     location = db.Column(db.String(64))
     about_me = db.Column(db.Text())
-    member_since = db.Column(db.DateTime(), default=datetime.utcnow)
+    member_since = db.Column(db.DateTime(), index=True, default=datetime.utcnow)
     last_seen = db.Column(db.DateTime(), default=datetime.utcnow)
     email = db.Column(db.String(64), unique=True, index=True)
     username = db.Column(db.String(64), unique=True, index=True)
     password_hash = db.Column(db.String(128))
     role_id = db.Column(db.Integer, db.ForeignKey("roles.id"))
     confirmed = db.Column(db.Boolean, default=False)
-    avatar_hash = db.Column(db.String(32))
+    avatar_hash = db.Column(db.String(32), index=True)
+    # Denormalized counts, maintained by the Post and Follow insert/delete events
+    post_count = db.Column(db.Integer, default=0)
+    follower_count = db.Column(db.Integer, default=0)
+    followed_count = db.Column(db.Integer, default=0)
     posts = db.relationship("Post", backref="author", lazy="dynamic")
     comments = db.relationship("Comment", backref="author", lazy="dynamic")
+    # Ordered explicitly, row order otherwise depends on which index the plan uses
     followed = db.relationship("Follow",
                                foreign_keys=[Follow.follower_id],
                                backref=db.backref("follower", lazy="joined"),
                                lazy="dynamic",
+                               order_by=Follow.timestamp,
                                cascade="all, delete-orphan")
     followers = db.relationship("Follow",
                                 foreign_keys=[Follow.followed_id],
                                 backref=db.backref("followed", lazy="joined"),
                                 lazy="dynamic",
+                                order_by=Follow.timestamp,
                                 cascade="all, delete-orphan")
                         
     
@@ -122,11 +286,11 @@ class User(UserMixin, db.Model):
         self.follow(self)
         
     def generate_confirmation_token(self, expiration=3600):
-        s = Serializer(current_app.config["SECRET_KEY"], expiration)
+        s = token_cache.serializer(expiration)
         return s.dumps({"confirm": self.id})
     
     def confirm(self, token):
-        s = Serializer(current_app.config["SECRET_KEY"])
+        s = token_cache.serializer()
         # verifies token is valid and has not expired
         try:
             data = s.loads(token)
@@ -146,17 +310,18 @@ class User(UserMixin, db.Model):
     
     @password.setter
     def password(self, password):
-        self.password_hash = generate_password_hash(password)
+        # hashed off the event loop when running under gevent
+        self.password_hash = hash_pool.generate_password_hash(password)
     
     def verify_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return hash_pool.check_password_hash(self.password_hash, password)
     
     def generate_reset_token(self, expiration=3600):
-        s = Serializer(current_app.config["SECRET_KEY"], expiration)
+        s = token_cache.serializer(expiration)
         return s.dumps({"reset": self.id})
         
     def reset_password(self, token, new_password):
-        s = Serializer(current_app.config["SECRET_KEY"])
+        s = token_cache.serializer()
         try:
             data = s.loads(token)
         except:
@@ -168,11 +333,11 @@ class User(UserMixin, db.Model):
         return True
         
     def generate_email_change_token(self, new_email, expiration=3600):
-        s = Serializer(current_app.config['SECRET_KEY'], expiration)
+        s = token_cache.serializer(expiration)
         return s.dumps({'change_email': self.id, 'new_email': new_email})
 
     def change_email(self, token):
-        s = Serializer(current_app.config['SECRET_KEY'])
+        s = token_cache.serializer()
         try:
             data = s.loads(token)
         except:
@@ -213,6 +378,17 @@ class User(UserMixin, db.Model):
         return "{url}/{hash}?s={size}&d={default}&r={rating}".format(
             url=url, hash=hash, size=size, default=default, rating=rating)
 
+    def avatar_url(self, size=180):
+        """Local identicon when BLOG_LOCAL_AVATARS is set, Gravatar otherwise"""
+        if not current_app.config["BLOG_LOCAL_AVATARS"]:
+            return self.gravatar(size=size)
+        hash = self.avatar_hash or hashlib.md5(self.email.encode("utf-8")).hexdigest()
+        return url_for("main.avatar", hash=hash, size=avatar_cache.size_for(size))
+
+    @staticmethod
+    def has_avatar_hash(hash):
+        return db.session.query(User.query.filter_by(avatar_hash=hash).exists()).scalar()
+
     # Helper functions for common following activities
     def follow(self, user):
         if not self.is_following(user):
@@ -232,39 +408,48 @@ class User(UserMixin, db.Model):
     
     def __repr__(self):
         return "<User %r>" % self.username
+
+    def cache_tags(self):
+        return ["author:%d" % self.id]
+
+    def etag_parts(self):
+        return (self.id, self.username, self.avatar_hash, self.last_seen,
+                self.post_count, self.follower_count, self.followed_count)
     
     @property
     def followed_posts(self):
-        return Post.query.join(Follow, Follow.followed_id == Post.author_id) \
-            .filter(Follow.follower_id == self.id)
+        return Timeline.posts(self.id)
             
     def generate_auth_token(self, expiration):
-        s = Serializer(current_app.config["SECRET_KEY"],
-                       expires_in=expiration)
+        s = token_cache.serializer(expiration)
 
         return s.dumps({"id": self.id}).decode("ascii")
         
     @staticmethod
     def verify_auth_token(token):
-        s = Serializer(current_app.config["SECRET_KEY"])
+        s = token_cache.serializer()
         try:
             data = s.loads(token)
         except:
             return None
         return User.query.get(data["id"])
     
-    def to_json(self):
-        json_user = {
-            "url": url_for("api.get_user", id=self.id, _external=True),
-            "username": self.username,
-            "member_since": self.member_since,
-            "last_seen": self.last_seen,
-            "posts": url_for("api.get_user_posts", id=self.id, _external=True),
-            "followed_posts": url_for("api.get_user_followed_posts",
-                                      id=self.id, _external=True),
-            "post_count": self.posts.count()
-        }
-        return json_user
+    json_fields = {
+        "id": lambda user: user.id,
+        "url": lambda user: external_url("api.get_user", user.id),
+        "username": lambda user: user.username,
+        "member_since": lambda user: user.member_since,
+        "last_seen": lambda user: user.last_seen,
+        "posts": lambda user: external_url("api.get_user_posts", user.id),
+        "followed_posts": lambda user: external_url("api.get_user_followed_posts",
+                                                    user.id),
+        "post_count": lambda user: user.post_count
+    }
+
+    json_embeds = ()
+
+    def to_json(self, fields=None, embed=()):
+        return project(self, User.json_fields, fields)
             
 
 class Permission:
@@ -291,8 +476,60 @@ login_manager.anonymous_user = AnonymousUser
 def load_user(user_id):
     """Required callback function for login manager to load a user 
     (user_id is supplied as a Unicode string)
-    User is loaded into current_user"""
-    return User.query.get(int(user_id))
+    User is loaded into current_user
+    Served from the per-worker identity cache, with the role already attached"""
+    return identity_cache.load_user(int(user_id))
+
+
+class UserSnapshot(object):
+    """Read-only copy of the user fields needed for permission checks, safe to keep in
+    caches shared between requests (ORM instances are bound to one request's session)"""
+    is_authenticated = True
+    is_active = True
+    is_anonymous = False
+
+    def __init__(self, user):
+        self.id = user.id
+        self.username = user.username
+        self.confirmed = user.confirmed
+        self.permissions = user.role.permissions if user.role is not None else None
+
+    @staticmethod
+    def load(user_id):
+        user = User.query.get(user_id)
+        return UserSnapshot(user) if user is not None else None
+
+    def get_id(self):
+        return str(self.id)
+
+    def can(self, permissions):
+        return self.permissions is not None and (self.permissions & permissions) == permissions
+
+    def is_administrator(self):
+        return self.can(Permission.ADMINISTER)
+
+
+# Attributes that change what a cached user snapshot says about a user
+SNAPSHOT_ATTRIBUTES = ("password_hash", "email", "role", "role_id", "confirmed", "username")
+
+
+def on_flush_user_changes(session, flush_context):
+    """Records the users whose cached snapshots must be dropped when the transaction commits
+    None stands for a change to the roles"""
+    tokens = session.info.setdefault("token_cache_users", set())
+    identities = session.info.setdefault("identity_cache_changes", set())
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, User):
+            state = db.inspect(obj)
+            if obj in session.deleted or any(state.attrs[name].history.has_changes()
+                                             for name in SNAPSHOT_ATTRIBUTES):
+                tokens.add(obj.id)
+            if obj in session.deleted or session.is_modified(obj):
+                identities.add(obj.id)
+        elif isinstance(obj, Role):
+            if db.inspect(obj).attrs.permissions.history.has_changes():
+                tokens.add(None)
+                identities.add(None)
 
 
 # New model that represents posts
@@ -301,9 +538,17 @@ class Post(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     body = db.Column(db.Text)
     body_html = db.Column(db.Text)
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    # Version of the renderer that produced body_html, older rows are stale
+    render_version = db.Column(db.Integer)
+    # Bumped on every change that shows up in the rendered post, keys the fragment cache
+    version = db.Column(db.Integer, default=0)
+    timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
     author_id = db.Column(db.Integer, db.ForeignKey("users.id"))
+    # Denormalized count, maintained by the Comment insert/delete events
+    comment_count = db.Column(db.Integer, default=0)
     comments = db.relationship("Comment", backref="post", lazy="dynamic")
+    __table_args__ = (db.Index("ix_posts_author_id_timestamp",
+                               "author_id", "timestamp"),)
 
     @staticmethod
     def generate_fake(count=100):
@@ -320,25 +565,91 @@ class Post(db.Model):
             db.session.add(p)
             db.session.commit()
     
+    allowed_tags = ["a", "abbr", "acronym", "b", "blockquote", "code", "em", "i", "li", "ol",
+                    "pre", "strong", "ul", "h1", "h2", "h3", "p"]
+
     @staticmethod
     def on_changed_body(target, value, oldvalue, initator):
-        allowed_tags = ["a", "abbr", "acronym", "b", "blockquote", "code", "em", "i", "li", "ol",
-                        "pre", "strong", "ul", "h1", "h2", "h3", "p"]
-        target.body_html = bleach.linkify(bleach.clean(
-            markdown(value, output_format="html"),
-            tags=allowed_tags, strip=True))
+        # Edits that don't change the text keep the existing HTML
+        if value == oldvalue and target.body_html is not None and \
+                target.render_version == RENDERER_VERSION:
+            return
+        target.body_html = render_cache.render(value, Post.allowed_tags)
+        target.render_version = RENDERER_VERSION
+        target.version = (target.version or 0) + 1
+        fragment_cache.invalidate("post", target.id)
+        search_index.stage(target)
+
+    @staticmethod
+    def on_loaded(target, context):
+        # Stale HTML is re-rendered on read and written back with the request's commit
+        if target.render_version != RENDERER_VERSION and target.body is not None:
+            target.body_html = render_cache.render(target.body, Post.allowed_tags)
+            target.render_version = RENDERER_VERSION
+            target.version = (target.version or 0) + 1
+
+    @staticmethod
+    def on_inserted(mapper, connection, target):
+        """Fans the new post out to the timelines of the author's followers"""
+        adjust_counter(connection, User, target.author_id, "post_count", 1)
+        search_index.flush(connection, "post", target)
+        if target.author_id is None or \
+                Timeline.is_heavy_author(connection, target.author_id):
+            return
+        follows = Follow.__table__
+        posts = Post.__table__
+        followers = db.select([follows.c.follower_id, posts.c.id, posts.c.timestamp]) \
+            .where(follows.c.followed_id == posts.c.author_id) \
+            .where(posts.c.id == target.id)
+        connection.execute(Timeline.__table__.insert().from_select(
+            ["owner_id", "post_id", "timestamp"], followers))
+
+    @staticmethod
+    def on_updated(mapper, connection, target):
+        search_index.flush(connection, "post", target)
+
+    @staticmethod
+    def on_deleting(mapper, connection, target):
+        adjust_counter(connection, User, target.author_id, "post_count", -1)
+        search_index.remove(connection, "post", target.id)
+        timelines = Timeline.__table__
+        connection.execute(timelines.delete().where(timelines.c.post_id == target.id))
+
+    def etag_parts(self):
+        # version covers edits and new comments
+        return (self.id, self.version, self.author_id)
+
+    def cache_tags(self):
+        tags = ["front page", "post:%d" % self.id]
+        if self.author_id is not None:
+            tags.append("author:%d" % self.author_id)
+        return tags
+
+    @staticmethod
+    def with_authors(query):
+        """Loads the authors and their roles in the same query as the posts,
+        instead of one lazy SELECT per row when a list is rendered"""
+        return query.options(db.joinedload(Post.author).joinedload(User.role))
     
-    def to_json(self):
-        # Comment count is "made-up" attribute. Shows a technique to add resource attributes without storing them.
-        json_post = {
-            "url": url_for("api.get_post", id=self.id, _external=True),
-            "body": self.body,
-            "body_html": self.body_html,
-            "timestamp": self.timestamp,
-            "author": url_for("api.get_user", id=self.author_id, _external=True),
-            "comments": url_for("api.get_post_comments", id=self.id, _external=True),
-            "comment_count": self.comments.count()
-        }
+    json_fields = {
+        "id": lambda post: post.id,
+        "url": lambda post: external_url("api.get_post", post.id),
+        "body": lambda post: post.body,
+        "body_html": lambda post: post.body_html,
+        "timestamp": lambda post: post.timestamp,
+        "author": lambda post: external_url("api.get_user", post.author_id),
+        "comments": lambda post: external_url("api.get_post_comments", post.id),
+        "comment_count": lambda post: post.comment_count
+    }
+
+    # related rows ?embed= can inline
+    json_embeds = ("author",)
+
+    def to_json(self, fields=None, embed=()):
+        json_post = project(self, Post.json_fields, fields)
+        # with_authors has already loaded the author, embedding it costs no query
+        if "author" in embed and "author" in json_post and self.author is not None:
+            json_post["author"] = self.author.to_json()
         return json_post
 
     @staticmethod
@@ -351,6 +662,10 @@ class Post(db.Model):
 # Function is registered as a listener of SQLAlchemy's "set" event for body
 ### Automatically invoked whenever the body field is changed (even listener automates conversion to HTML)
 db.event.listen(Post.body, "set", Post.on_changed_body)
+db.event.listen(Post, "after_insert", Post.on_inserted)
+db.event.listen(Post, "load", Post.on_loaded)
+db.event.listen(Post, "before_delete", Post.on_deleting)
+db.event.listen(Post, "after_update", Post.on_updated)
 
 
 class Comment(db.Model):
@@ -358,30 +673,90 @@ class Comment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     body = db.Column(db.Text)
     body_html = db.Column(db.Text)
+    render_version = db.Column(db.Integer)
+    version = db.Column(db.Integer, default=0)
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
     disabled = db.Column(db.Boolean)
     author_id = db.Column(db.Integer, db.ForeignKey("users.id"))
     post_id = db.Column(db.Integer, db.ForeignKey("posts.id"))
+    __table_args__ = (db.Index("ix_comments_post_id_timestamp",
+                               "post_id", "timestamp"),)
     
+    allowed_tags = ['a', 'abbr', 'acronym', 'b', 'code', 'em', 'i',
+                    'strong']
+
     @staticmethod
     def on_changed_body(target, value, oldvalue, initiator):
-        allowed_tags = ['a', 'abbr', 'acronym', 'b', 'code', 'em', 'i',
-                        'strong']
-        target.body_html = bleach.linkify(bleach.clean(
-            markdown(value, output_format="html"),
-            tags=allowed_tags, strip=True))
+        if value == oldvalue and target.body_html is not None and \
+                target.render_version == RENDERER_VERSION:
+            return
+        target.body_html = render_cache.render(value, Comment.allowed_tags)
+        target.render_version = RENDERER_VERSION
+        target.version = (target.version or 0) + 1
+        fragment_cache.invalidate("comment", target.id)
+        search_index.stage(target)
+
+    @staticmethod
+    def on_changed_disabled(target, value, oldvalue, initiator):
+        if value != oldvalue:
+            target.version = (target.version or 0) + 1
+            fragment_cache.invalidate("comment", target.id)
+
+    @staticmethod
+    def on_loaded(target, context):
+        if target.render_version != RENDERER_VERSION and target.body is not None:
+            target.body_html = render_cache.render(target.body, Comment.allowed_tags)
+            target.render_version = RENDERER_VERSION
+            target.version = (target.version or 0) + 1
+
+    @staticmethod
+    def on_inserted(mapper, connection, target):
+        # The comment count is part of the rendered post
+        adjust_counter(connection, Post, target.post_id, "comment_count", 1)
+        adjust_counter(connection, Post, target.post_id, "version", 1)
+        fragment_cache.invalidate("post", target.post_id)
+        search_index.flush(connection, "comment", target)
+
+    @staticmethod
+    def on_updated(mapper, connection, target):
+        search_index.flush(connection, "comment", target)
+
+    @staticmethod
+    def on_deleted(mapper, connection, target):
+        adjust_counter(connection, Post, target.post_id, "comment_count", -1)
+        adjust_counter(connection, Post, target.post_id, "version", 1)
+        fragment_cache.invalidate("post", target.post_id)
+        search_index.remove(connection, "comment", target.id)
+
+    @staticmethod
+    def with_authors(query):
+        return query.options(db.joinedload(Comment.author).joinedload(User.role))
+
+    def etag_parts(self):
+        return (self.id, self.version, self.post_id, self.author_id)
+
+    def cache_tags(self):
+        if self.post_id is None:
+            return []
+        return ["post:%d" % self.post_id]
             
-    def to_json(self):
-            json_comment = {
-                'url': url_for('api.get_comment', id=self.id, _external=True),
-                'post': url_for('api.get_post', id=self.post_id, _external=True),
-                'body': self.body,
-                'body_html': self.body_html,
-                'timestamp': self.timestamp,
-                'author': url_for('api.get_user', id=self.author_id,
-                                  _external=True),
-            }
-            return json_comment
+    json_fields = {
+        'id': lambda comment: comment.id,
+        'url': lambda comment: external_url('api.get_comment', comment.id),
+        'post': lambda comment: external_url('api.get_post', comment.post_id),
+        'body': lambda comment: comment.body,
+        'body_html': lambda comment: comment.body_html,
+        'timestamp': lambda comment: comment.timestamp,
+        'author': lambda comment: external_url('api.get_user', comment.author_id),
+    }
+
+    json_embeds = ("author",)
+
+    def to_json(self, fields=None, embed=()):
+        json_comment = project(self, Comment.json_fields, fields)
+        if "author" in embed and "author" in json_comment and self.author is not None:
+            json_comment["author"] = self.author.to_json()
+        return json_comment
 
     @staticmethod
     def from_json(json_comment):
@@ -391,3 +766,21 @@ class Comment(db.Model):
         return Comment(body=body)
             
 db.event.listen(Comment.body, "set", Comment.on_changed_body)
+db.event.listen(Comment.disabled, "set", Comment.on_changed_disabled)
+db.event.listen(Comment, "after_insert", Comment.on_inserted)
+db.event.listen(Comment, "load", Comment.on_loaded)
+db.event.listen(Comment, "after_delete", Comment.on_deleted)
+db.event.listen(Comment, "after_update", Comment.on_updated)
+
+# Cached anonymous pages are invalidated by the tags of the rows each commit changes.
+# db.session is a scoped_session over a factory, so session events go on the class
+db.event.listen(SignallingSession, "after_flush", page_cache.on_flush)
+db.event.listen(SignallingSession, "after_commit", page_cache.on_commit)
+db.event.listen(SignallingSession, "after_soft_rollback", page_cache.on_rollback)
+db.event.listen(SignallingSession, "after_flush", on_flush_user_changes)
+db.event.listen(SignallingSession, "after_commit", token_cache.on_commit)
+db.event.listen(SignallingSession, "after_soft_rollback", token_cache.on_rollback)
+db.event.listen(SignallingSession, "after_commit", last_seen_buffer.on_commit)
+db.event.listen(SignallingSession, "after_soft_rollback", last_seen_buffer.on_rollback)
+db.event.listen(SignallingSession, "after_commit", identity_cache.on_commit)
+db.event.listen(SignallingSession, "after_soft_rollback", identity_cache.on_rollback)
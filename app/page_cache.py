@@ -0,0 +1,146 @@
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import current_app, g, request, session, make_response
+from flask_login import current_user
+
+
+class CachedPage(object):
+    def __init__(self, response, tags, ttl, stale):
+        self.body = response.get_data()
+        self.status = response.status_code
+        self.headers = list(response.headers.items())
+        self.tags = set(tags)
+        now = time.time()
+        self.fresh_until = now + ttl
+        self.stale_until = now + ttl + stale
+
+    def response(self, state):
+        response = current_app.response_class(self.body, self.status, self.headers)
+        response.headers["X-Page-Cache"] = state
+        # the stored validators still answer conditional requests on a hit
+        return response.make_conditional(request)
+
+
+class PageCache(object):
+    """Whole page cache for anonymous GET requests, keyed by the full URL
+    Entries are tagged with the posts and authors they show ("post:1", "author:2",
+    "front page") and committed changes to those rows mark them stale.
+    A stale entry keeps being served while the first request to see it regenerates the page,
+    and on a miss only one request renders the page while the others wait for it"""
+
+    def __init__(self, app=None):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.key_locks = {}
+        self.refreshing = set()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config["BLOG_PAGE_CACHE"]
+        self.ttl = app.config["BLOG_PAGE_CACHE_TTL"]
+        self.stale = app.config["BLOG_PAGE_CACHE_STALE"]
+        self.maxsize = app.config["BLOG_PAGE_CACHE_SIZE"]
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.refreshing.clear()
+
+    @staticmethod
+    def tag(*tags):
+        """Called by views to record what the page being rendered depends on"""
+        g.setdefault("page_cache_tags", set()).update(tags)
+
+    def invalidate(self, tags):
+        tags = set(tags)
+        if not tags:
+            return
+        with self.lock:
+            for entry in self.entries.values():
+                if entry.tags & tags:
+                    entry.fresh_until = 0
+
+    def cacheable(self):
+        return self.enabled and request.method == "GET" and \
+            not current_user.is_authenticated and "_flashes" not in session
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def store(self, key, rv):
+        response = make_response(rv)
+        # Responses that change the session or set cookies belong to a single client
+        if response.status_code != 200 or "Set-Cookie" in response.headers or \
+                session.modified or response.direct_passthrough:
+            return response
+        entry = CachedPage(response, g.get("page_cache_tags", ()), self.ttl, self.stale)
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        response.headers["X-Page-Cache"] = "miss"
+        return response
+
+    def key_lock(self, key):
+        with self.lock:
+            return self.key_locks.setdefault(key, threading.Lock())
+
+    def cached(self, f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if not self.cacheable():
+                return f(*args, **kwargs)
+            key = request.url
+            entry = self.get(key)
+            now = time.time()
+            if entry is not None and now < entry.fresh_until:
+                return entry.response("hit")
+            if entry is not None and now < entry.stale_until:
+                with self.lock:
+                    if key in self.refreshing:
+                        # someone else is regenerating it
+                        return entry.response("stale")
+                    self.refreshing.add(key)
+                try:
+                    return self.store(key, f(*args, **kwargs))
+                finally:
+                    with self.lock:
+                        self.refreshing.discard(key)
+            lock = self.key_lock(key)
+            with lock:
+                # the page may have been rendered while waiting for the lock
+                entry = self.get(key)
+                if entry is not None and time.time() < entry.fresh_until:
+                    return entry.response("hit")
+                try:
+                    return self.store(key, f(*args, **kwargs))
+                finally:
+                    with self.lock:
+                        self.key_locks.pop(key, None)
+        return decorated_function
+
+    # Session event hooks, tags are collected when rows are flushed
+    # and only invalidated once the transaction commits
+    @staticmethod
+    def on_flush(session, flush_context):
+        tags = session.info.setdefault("page_cache_tags", set())
+        for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+            cache_tags = getattr(obj, "cache_tags", None)
+            if cache_tags is not None:
+                tags.update(cache_tags())
+
+    def on_commit(self, session):
+        self.invalidate(session.info.pop("page_cache_tags", ()))
+
+    @staticmethod
+    def on_rollback(session, previous_transaction):
+        session.info.pop("page_cache_tags", None)
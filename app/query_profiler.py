@@ -0,0 +1,118 @@
+import json
+import logging
+import random
+import re
+import time
+from collections import Counter
+from flask import current_app, g, request, has_request_context
+from sqlalchemy import event
+
+# Collapses IN (?, ?, ?) lists and literals so one query repeated with different
+# values counts as a single shape
+PARAMETER_LIST = re.compile(r"\(\s*(?:\?|%s|%\(\w+\)s|:\w+)(?:\s*,\s*(?:\?|%s|%\(\w+\)s|:\w+))*\s*\)")
+NUMBER = re.compile(r"\b\d+\b")
+WHITESPACE = re.compile(r"\s+")
+
+
+def statement_shape(statement):
+    shape = PARAMETER_LIST.sub("(?)", statement)
+    shape = NUMBER.sub("N", shape)
+    return WHITESPACE.sub(" ", shape).strip()
+
+
+class RequestProfile(object):
+    def __init__(self, sampled=True):
+        self.sampled = sampled
+        self.started = time.time()
+        self.count = 0
+        self.duration = 0.0
+        self.shapes = Counter()
+        self.slow = []
+
+    def record(self, statement, parameters, duration, slow_time):
+        if duration >= slow_time:
+            self.slow.append((statement, parameters, duration))
+        if self.sampled:
+            self.count += 1
+            self.duration += duration
+            self.shapes[statement] += 1
+
+
+class QueryProfiler(object):
+    """Per request query statistics from SQLAlchemy engine events
+    Every request gets a RequestProfile in g and every statement slower than
+    SLOW_DB_QUERY_TIME is logged as a warning after the request. A sampled request also
+    adds each statement to the count, the total DB time and the number of times that
+    statement shape ran, and one JSON log line sums it up. That line is a warning when a
+    statement was slow or a shape repeated often enough to look like an N+1, info otherwise,
+    and is not built at all when the logger would drop it. When disabled no listeners are
+    attached, so queries pay nothing"""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not app.config["BLOG_QUERY_PROFILER"]:
+            return
+        from . import db
+        engine = db.get_engine(app)
+        event.listen(engine, "before_cursor_execute", self.before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", self.after_cursor_execute)
+        app.before_request(self.start)
+        app.after_request(self.finish)
+
+    @staticmethod
+    def start():
+        sample_rate = current_app.config["BLOG_QUERY_PROFILER_SAMPLE_RATE"]
+        g.query_profile = RequestProfile(sample_rate >= 1 or random.random() < sample_rate)
+
+    @staticmethod
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if has_request_context() and "query_profile" in g:
+            context.query_profile_start = time.time()
+
+    @staticmethod
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "query_profile_start", None)
+        if started is None:
+            return
+        profile = g.get("query_profile")
+        if profile is not None:
+            profile.record(statement, parameters, time.time() - started,
+                           current_app.config["SLOW_DB_QUERY_TIME"])
+
+    @staticmethod
+    def finish(response):
+        profile = g.pop("query_profile", None)
+        if profile is None:
+            return response
+        # Slow statements are reported whether or not the request was sampled
+        for statement, parameters, duration in profile.slow:
+            current_app.logger.warning("Slow query: %s\nParameters: %s\nDuration: %fs\n",
+                                       statement, parameters, duration)
+        if not profile.sampled:
+            return response
+        threshold = current_app.config["BLOG_QUERY_PROFILER_REPEAT_THRESHOLD"]
+        shapes = Counter()
+        for statement, count in profile.shapes.items():
+            shapes[statement_shape(statement)] += count
+        repeated = [{"statement": shape, "count": count}
+                    for shape, count in shapes.most_common() if count >= threshold]
+        level = logging.WARNING if repeated or profile.slow else logging.INFO
+        if not current_app.logger.isEnabledFor(level):
+            return response
+        line = json.dumps({
+            "method": request.method,
+            "path": request.path,
+            "endpoint": request.endpoint,
+            "status": response.status_code,
+            "queries": profile.count,
+            "db_ms": round(profile.duration * 1000, 2),
+            "request_ms": round((time.time() - profile.started) * 1000, 2),
+            "repeated": repeated,
+            "slow": [{"statement": statement, "ms": round(duration * 1000, 2)}
+                     for statement, parameters, duration in profile.slow]
+        }, sort_keys=True)
+        current_app.logger.log(level, "query profile %s", line)
+        return response
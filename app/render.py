@@ -0,0 +1,130 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import bleach
+import markdown as markdown_module
+from markdown import markdown
+
+# Bump when the rendering pipeline or the allowed tags change so cached and stored HTML is rebuilt
+RENDERER_VERSION = 1
+
+
+def render(body, allowed_tags):
+    return bleach.linkify(bleach.clean(
+        markdown(body, output_format="html"),
+        tags=allowed_tags, strip=True))
+
+
+def render_rows(rows, allowed_tags):
+    """Renders a list of (id, body) rows, runs in the rerender worker processes"""
+    return [{"row_id": id, "body_html": render(body, allowed_tags) if body is not None else None}
+            for id, body in rows]
+
+
+class RenderCache(object):
+    """Bounded LRU cache of sanitized Markdown-to-HTML output
+    Keyed by a hash of the body, the allowed tags and the renderer version,
+    so identical bodies are only run through markdown and bleach once"""
+
+    def __init__(self, app=None, maxsize=1024):
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.maxsize = app.config.get("BLOG_RENDER_CACHE_SIZE", self.maxsize)
+
+    @staticmethod
+    def key(body, allowed_tags):
+        parts = [str(RENDERER_VERSION), markdown_module.version, bleach.__version__,
+                 ",".join(sorted(allowed_tags)), body]
+        return hashlib.sha1("\0".join(parts).encode("utf-8")).hexdigest()
+
+    def render(self, body, allowed_tags):
+        if body is None:
+            return None
+        key = self.key(body, allowed_tags)
+        with self.lock:
+            html = self.entries.get(key)
+            if html is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return html
+            self.misses += 1
+        # Rendering happens outside the lock, a concurrent miss on the same body just renders twice
+        html = render(body, allowed_tags)
+        with self.lock:
+            self.entries[key] = html
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return html
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        with self.lock:
+            return {"size": len(self.entries), "maxsize": self.maxsize,
+                    "hits": self.hits, "misses": self.misses,
+                    "evictions": self.evictions}
+
+
+def rerender(db, model, chunk_size=500, processes=None, checkpoint=None):
+    """Re-renders body_html for every stale row of a Post or Comment table
+    Rows are read in id order in chunks, rendered in a process pool and written
+    back with one executemany UPDATE per chunk. The last id written is saved to the
+    checkpoint file after each chunk so an interrupted run picks up where it stopped.
+    A checkpoint left by another renderer version is ignored
+    Returns the number of rows re-rendered"""
+    table = model.__table__
+    progress = {}
+    if checkpoint and os.path.exists(checkpoint):
+        with open(checkpoint) as f:
+            progress = json.load(f)
+        if progress.get("renderer_version") != RENDERER_VERSION:
+            progress = {}
+    progress["renderer_version"] = RENDERER_VERSION
+    last_id = progress.get(table.name, 0)
+    stale = db.or_(table.c.render_version == None,
+                   table.c.render_version != RENDERER_VERSION)
+    update = table.update().where(table.c.id == db.bindparam("row_id")) \
+        .values(body_html=db.bindparam("body_html"), render_version=RENDERER_VERSION,
+                version=db.func.coalesce(table.c.version, 0) + 1)
+    processes = processes or os.cpu_count() or 1
+    count = 0
+    with ProcessPoolExecutor(processes) as pool:
+        while True:
+            rows = db.session.execute(
+                db.select([table.c.id, table.c.body])
+                .where(table.c.id > last_id).where(stale)
+                .order_by(table.c.id).limit(chunk_size)).fetchall()
+            if not rows:
+                break
+            rows = [(row[0], row[1]) for row in rows]
+            # One slice per worker so each process gets a share of the chunk
+            step = max(1, -(-len(rows) // processes))
+            slices = [rows[i:i + step] for i in range(0, len(rows), step)]
+            results = []
+            for rendered in pool.map(render_rows, slices,
+                                     [model.allowed_tags] * len(slices)):
+                results.extend(rendered)
+            db.session.execute(update, results)
+            db.session.commit()
+            count += len(results)
+            last_id = rows[-1][0]
+            if checkpoint:
+                progress[table.name] = last_id
+                with open(checkpoint, "w") as f:
+                    json.dump(progress, f)
+    return count
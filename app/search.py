@@ -0,0 +1,207 @@
+import re
+from collections import Counter
+from flask import current_app
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+MAX_TERM_LENGTH = 64
+MAX_QUERY_TERMS = 10
+KINDS = ("post", "comment")
+
+
+def tokenize(body):
+    return [token for token in TOKEN_PATTERN.findall((body or "").lower())
+            if 1 < len(token) <= MAX_TERM_LENGTH]
+
+
+def query_terms(q):
+    terms = []
+    for term in tokenize(q):
+        if term not in terms:
+            terms.append(term)
+    return terms[:MAX_QUERY_TERMS]
+
+
+# Posts and comments share one FTS5 table. The kind is packed into the rowid
+# so an update can delete the old row by key instead of scanning the table
+def fts_rowid(kind, id):
+    return id * len(KINDS) + KINDS.index(kind)
+
+
+def fts_key(rowid):
+    return KINDS[rowid % len(KINDS)], rowid // len(KINDS)
+
+
+def fts5_available(ddl, target, bind, **kw):
+    """DDL condition for the FTS5 table: SQLite built with the fts5 module"""
+    if bind.dialect.name != "sqlite":
+        return False
+    try:
+        bind.execute(text("CREATE VIRTUAL TABLE temp.fts5_probe USING fts5(body)"))
+        bind.execute(text("DROP TABLE temp.fts5_probe"))
+        return True
+    except DBAPIError:
+        return False
+
+
+CREATE_FTS = "CREATE VIRTUAL TABLE IF NOT EXISTS search_fts USING fts5(body)"
+DROP_FTS = "DROP TABLE IF EXISTS search_fts"
+
+
+class SearchIndex(object):
+    """Full text index over post and comment bodies
+    On SQLite with FTS5 the bodies go into a search_fts virtual table ranked with bm25.
+    Anywhere else the Python tokenizer fills the search_terms table (term -> documents),
+    ranked by term frequency weighted by how rare each term is.
+    The body "set" events stage a row and the mapper events write it on the flush's
+    connection, so the index commits or rolls back with the row itself"""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        backend = app.config["BLOG_SEARCH_BACKEND"]
+        if backend not in ("auto", "fts5", "terms"):
+            raise ValueError("Unknown search backend %r" % backend)
+        app.extensions["search_index"] = {"backend": backend}
+
+    def backend(self, connection):
+        state = current_app.extensions["search_index"]
+        if state["backend"] == "auto":
+            found = connection.dialect.name == "sqlite" and connection.execute(text(
+                "SELECT name FROM sqlite_master WHERE name = 'search_fts'")).first()
+            state["backend"] = "fts5" if found else "terms"
+        return state["backend"]
+
+    @staticmethod
+    def stage(target):
+        """Called from the body set events, the row may not have an id yet"""
+        target._search_pending = True
+
+    def flush(self, connection, kind, target):
+        if target.__dict__.pop("_search_pending", False):
+            self.index(connection, kind, target.id, target.body)
+
+    def index(self, connection, kind, id, body):
+        self.remove(connection, kind, id)
+        if self.backend(connection) == "fts5":
+            if body:
+                connection.execute(text(
+                    "INSERT INTO search_fts (rowid, body) VALUES (:rowid, :body)"),
+                    rowid=fts_rowid(kind, id), body=body)
+            return
+        from .models import SearchTerm
+        counts = Counter(tokenize(body))
+        if counts:
+            connection.execute(SearchTerm.__table__.insert(), [
+                {"term": term, "kind": kind, "doc_id": id, "count": count}
+                for term, count in counts.items()])
+
+    def remove(self, connection, kind, id):
+        if self.backend(connection) == "fts5":
+            connection.execute(text("DELETE FROM search_fts WHERE rowid = :rowid"),
+                               rowid=fts_rowid(kind, id))
+            return
+        from .models import SearchTerm
+        terms = SearchTerm.__table__
+        connection.execute(terms.delete().where(terms.c.kind == kind)
+                           .where(terms.c.doc_id == id))
+
+    def search(self, connection, q, kind=None, limit=20, offset=0):
+        """Returns ranked (kind, id, score) tuples, best match first"""
+        terms = query_terms(q)
+        if not terms:
+            return []
+        if self.backend(connection) == "fts5":
+            # Quoting each term keeps FTS5 query syntax out of user input
+            sql = "SELECT rowid, -bm25(search_fts) AS score FROM search_fts " \
+                  "WHERE search_fts MATCH :match"
+            params = {"match": " ".join('"%s"' % term for term in terms),
+                      "limit": limit, "offset": offset}
+            if kind is not None:
+                sql += " AND rowid % :kinds = :kind"
+                params.update(kinds=len(KINDS), kind=KINDS.index(kind))
+            rows = connection.execute(text(sql + " ORDER BY score DESC, rowid DESC "
+                                           "LIMIT :limit OFFSET :offset"), **params)
+            return [fts_key(row.rowid) + (row.score,) for row in rows]
+
+        from . import db
+        from .models import SearchTerm
+        t = SearchTerm.__table__
+        frequencies = dict(connection.execute(
+            db.select([t.c.term, db.func.count()]).where(t.c.term.in_(terms))
+            .group_by(t.c.term)).fetchall())
+        if len(frequencies) < len(terms):
+            # every term has to match
+            return []
+        weight = db.case([(t.c.term == term, 1.0 / frequencies[term]) for term in terms])
+        score = db.func.sum(t.c.count * weight).label("score")
+        query = db.select([t.c.kind, t.c.doc_id, score]).where(t.c.term.in_(terms))
+        if kind is not None:
+            query = query.where(t.c.kind == kind)
+        query = query.group_by(t.c.kind, t.c.doc_id) \
+            .having(db.func.count() == len(terms)) \
+            .order_by(score.desc(), t.c.doc_id.desc()).limit(limit).offset(offset)
+        return [(row.kind, row.doc_id, row.score) for row in connection.execute(query)]
+
+    def results(self, q, kind=None, page=1, per_page=20):
+        """Loads the rows for one page of hits, returns ([(kind, row, score)], has_next)
+        Disabled comments and rows deleted since they were indexed are skipped"""
+        from . import db
+        from .models import Post, Comment
+        hits = self.search(db.session.connection(), q, kind=kind,
+                           limit=per_page + 1, offset=(page - 1) * per_page)
+        has_next = len(hits) > per_page
+        hits = hits[:per_page]
+        rows = {}
+        for model, name in ((Post, "post"), (Comment, "comment")):
+            ids = [id for hit_kind, id, score in hits if hit_kind == name]
+            if ids:
+                for row in model.with_authors(model.query).filter(model.id.in_(ids)):
+                    rows[name, row.id] = row
+        results = []
+        for hit_kind, id, score in hits:
+            row = rows.get((hit_kind, id))
+            if row is None or (hit_kind == "comment" and row.disabled):
+                continue
+            results.append((hit_kind, row, score))
+        return results, has_next
+
+    def rebuild(self, connection, rows, kind, chunk_size=500):
+        """Indexes (id, body) rows streamed from a table in batched inserts
+        The index should be cleared first, nothing is deleted here"""
+        fts = self.backend(connection) == "fts5"
+        count = 0
+        batch = []
+        for id, body in rows:
+            if fts:
+                if body:
+                    batch.append({"rowid": fts_rowid(kind, id), "body": body})
+            else:
+                batch.extend({"term": term, "kind": kind, "doc_id": id, "count": n}
+                             for term, n in Counter(tokenize(body)).items())
+            count += 1
+            if len(batch) >= chunk_size:
+                self.insert_batch(connection, fts, batch)
+                batch = []
+        if batch:
+            self.insert_batch(connection, fts, batch)
+        return count
+
+    @staticmethod
+    def insert_batch(connection, fts, batch):
+        if fts:
+            connection.execute(text(
+                "INSERT INTO search_fts (rowid, body) VALUES (:rowid, :body)"), batch)
+        else:
+            from .models import SearchTerm
+            connection.execute(SearchTerm.__table__.insert(), batch)
+
+    def clear(self, connection):
+        if self.backend(connection) == "fts5":
+            connection.execute(text("DELETE FROM search_fts"))
+        else:
+            from .models import SearchTerm
+            connection.execute(SearchTerm.__table__.delete())
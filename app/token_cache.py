@@ -0,0 +1,96 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
+
+
+class TokenCache(object):
+    """Caches verified API tokens so repeat requests skip the signature check and the user query
+    Entries are keyed by a digest of the token and expire with the token itself, or after
+    BLOG_TOKEN_CACHE_TTL so changes committed in other workers are picked up.
+    Committed password, email, role and confirmation changes drop the user's entries in this worker"""
+
+    def __init__(self, app=None):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.user_tokens = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.maxsize = app.config["BLOG_TOKEN_CACHE_SIZE"]
+        self.ttl = app.config["BLOG_TOKEN_CACHE_TTL"]
+        # serializers by expiration, built once per app
+        app.extensions["token_cache"] = {}
+        self.clear()
+
+    def serializer(self, expires_in=None):
+        serializers = current_app.extensions["token_cache"]
+        s = serializers.get(expires_in)
+        if s is None:
+            s = serializers[expires_in] = Serializer(current_app.config["SECRET_KEY"],
+                                                     expires_in=expires_in)
+        return s
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.user_tokens.clear()
+
+    def verify(self, token, load_user):
+        """Returns the user snapshot for a token, or None if it is invalid or expired
+        load_user is called with the user id from the token on a miss"""
+        digest = hashlib.sha256(token.encode("utf-8")).hexdigest()
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(digest)
+            if entry is not None:
+                expires, user = entry
+                if expires > now:
+                    self.entries.move_to_end(digest)
+                    return user
+                self.remove(digest)
+        try:
+            data, header = self.serializer().loads(token, return_header=True)
+        except:
+            return None
+        user = load_user(data["id"])
+        if user is None:
+            return None
+        expires = min(header.get("exp", now), now + self.ttl)
+        with self.lock:
+            self.entries[digest] = (expires, user)
+            self.user_tokens.setdefault(user.id, set()).add(digest)
+            while len(self.entries) > self.maxsize:
+                self.remove(next(iter(self.entries)))
+        return user
+
+    def remove(self, digest):
+        # caller holds the lock
+        expires, user = self.entries.pop(digest)
+        tokens = self.user_tokens.get(user.id)
+        if tokens is not None:
+            tokens.discard(digest)
+            if not tokens:
+                del self.user_tokens[user.id]
+
+    def invalidate(self, user_id):
+        with self.lock:
+            for digest in list(self.user_tokens.get(user_id, ())):
+                self.remove(digest)
+
+    # Session event hooks, the models record which users changed in session.info
+    def on_commit(self, session):
+        user_ids = session.info.pop("token_cache_users", set())
+        if None in user_ids:
+            # role permissions changed, every snapshot may be wrong
+            self.clear()
+            return
+        for user_id in user_ids:
+            self.invalidate(user_id)
+
+    @staticmethod
+    def on_rollback(session, previous_transaction):
+        session.info.pop("token_cache_users", None)
@@ -0,0 +1,29 @@
+from flask import current_app, url_for, _app_ctx_stack, _request_ctx_stack
+
+# Built in place of the id once, then cut out to leave the text around it
+SENTINEL = 918273645546372819
+# Without SERVER_NAME the host comes from the request, so a client choosing Host
+# headers could add templates forever. Past this many they are all dropped and rebuilt
+MAX_TEMPLATES = 256
+
+
+def external_url(endpoint, id):
+    """Same string as url_for(endpoint, id=id, _external=True) without building
+    through the URL map every time. The first call for an endpoint on a host
+    builds the URL once and keeps the parts before and after the id, later calls
+    just put the id between them. Ids that aren't ints go through url_for as before"""
+    top = _request_ctx_stack.top or _app_ctx_stack.top
+    adapter = top.url_adapter if top is not None else None
+    if type(id) is not int or adapter is None:
+        return url_for(endpoint, id=id, _external=True)
+    key = (endpoint, adapter.url_scheme, adapter.server_name, adapter.script_name,
+           adapter.subdomain)
+    templates = current_app.extensions.setdefault("url_templates", {})
+    template = templates.get(key)
+    if template is None:
+        url = url_for(endpoint, id=SENTINEL, _external=True)
+        prefix, sentinel, suffix = url.partition(str(SENTINEL))
+        if len(templates) >= MAX_TEMPLATES:
+            templates.clear()
+        template = templates[key] = (prefix, suffix)
+    return template[0] + str(id) + template[1]
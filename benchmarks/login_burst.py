@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+"""Tail latency of page requests while a burst of logins hashes passwords
+
+Runs the same workload twice inside one gevent process, first with password hashing
+inline on the event loop and then on the native thread pool:
+
+    python benchmarks/login_burst.py --logins 50 --requests 200
+
+Page requests hit the health check through the test client so the numbers
+only measure how long each request waits for the event loop.
+"""
+from gevent import monkey
+monkey.patch_all()
+
+import argparse
+import os
+import sys
+import time
+import gevent
+from werkzeug.security import generate_password_hash
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from app import create_app, hash_pool
+from gevent.threadpool import ThreadPool
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+
+def run(app, logins, requests, concurrency):
+    password_hash = generate_password_hash("cat")
+    client = app.test_client()
+    latencies = []
+
+    def login():
+        hash_pool.check_password_hash(password_hash, "cat")
+
+    def page(count):
+        for i in range(count):
+            start = time.time()
+            client.get("/_ah/health")
+            latencies.append(time.time() - start)
+            gevent.sleep(0.001)
+
+    burst = [gevent.spawn(login) for i in range(logins)]
+    pages = [gevent.spawn(page, requests // concurrency) for i in range(concurrency)]
+    gevent.joinall(burst + pages)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--logins", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--pool-size", type=int, default=2)
+    args = parser.parse_args()
+
+    app = create_app("testing")
+    with app.app_context():
+        for name, pool in (("inline", None), ("thread pool", ThreadPool(args.pool_size))):
+            hash_pool.pool = pool
+            latencies = run(app, args.logins, args.requests, args.concurrency)
+            print("%-12s p50 %7.1fms  p99 %7.1fms  max %7.1fms" % (
+                name, percentile(latencies, 50) * 1000,
+                percentile(latencies, 99) * 1000, max(latencies) * 1000))
+
+
+if __name__ == "__main__":
+    main()
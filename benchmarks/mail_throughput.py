@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+"""Outgoing mail throughput, one thread per message versus the pooled mail queue
+
+Both runs deliver to a local SMTP sink, so nothing leaves the machine:
+
+    python benchmarks/mail_throughput.py --messages 500 --port 1025
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from flask_mail import Message
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from app import create_app, mail
+from app.email import mail_queue
+from app.mail_sink import SinkServer
+
+
+def message(i):
+    return Message("Benchmark %d" % i, sender="bench@localhost",
+                   recipients=["sink@localhost"], body="x" * 2000)
+
+
+def thread_per_message(app, count):
+    def send(msg):
+        with app.app_context():
+            mail.send(msg)
+    threads = [threading.Thread(target=send, args=[message(i)]) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def pooled(app, count):
+    for i in range(count):
+        mail_queue.put(message(i))
+    mail_queue.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--port", type=int, default=1025)
+    args = parser.parse_args()
+
+    app = create_app("development")
+    app.config.update(MAIL_SERVER="localhost", MAIL_PORT=args.port, MAIL_USE_TLS=False,
+                      MAIL_USERNAME=None, MAIL_PASSWORD=None)
+    # Flask-Mail copies its settings when it is initialised
+    mail.init_app(app)
+    sink = SinkServer("localhost", args.port)
+    sink.serve_in_thread()
+    with app.app_context():
+        for name, run in (("per message", thread_per_message), ("mail queue", pooled)):
+            sink.count = 0
+            start = time.time()
+            run(app, args.messages)
+            elapsed = time.time() - start
+            print("%-12s %5d sent in %6.2fs  %7.1f msg/s" % (
+                name, sink.count, elapsed, sink.count / elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+"""Encode time and payload size of one page of Post.to_json output
+
+Compares flask.jsonify (pretty printed, as browsers got it, and compact, as xhr got it)
+with the API's compact JSON serializer and msgpack:
+
+    python benchmarks/serializers.py --posts 25 --repeat 2000
+"""
+import argparse
+import os
+import sys
+import timeit
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from flask import jsonify
+from app import create_app
+from app.models import Post
+from app.api_1_0.serializers import SERIALIZERS
+
+
+def page_of_posts(count):
+    posts = []
+    for i in range(count):
+        post = Post(body="Post number %d with some *markdown* in it. " % i * 4)
+        post.id = i + 1
+        post.author_id = i % 5 + 1
+        post.comment_count = i
+        post.timestamp = datetime(2017, 1, 1) + timedelta(minutes=i)
+        posts.append(post)
+    return {"posts": [post.to_json() for post in posts],
+            "prev": None, "next": "http://localhost/api/v1.0/posts/?page=2", "count": 1000}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--posts", type=int, default=25)
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    app = create_app("testing")
+    with app.test_request_context():
+        page = page_of_posts(args.posts)
+        encoders = [
+            ("jsonify pretty", lambda: jsonify(page).get_data()),
+            ("jsonify compact", lambda: jsonify(page).get_data()),
+        ]
+        for mimetype, serializer in SERIALIZERS.items():
+            if mimetype == serializer.mimetype:
+                encoders.append((mimetype, lambda serializer=serializer: serializer.dumps(page)))
+        for name, encode in encoders:
+            app.config["JSONIFY_PRETTYPRINT_REGULAR"] = name != "jsonify compact"
+            seconds = timeit.timeit(encode, number=args.repeat) / args.repeat
+            print("%-20s %8.1fus  %7d bytes" % (name, seconds * 1e6, len(encode())))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 import os
+import tempfile
 basedir = os.path.abspath(os.path.dirname(__file__))
 
 
@@ -6,7 +7,7 @@ class Config():
     SECRET_KEY = os.environ.get("SECRET_KEY") or "rreeaasskkggheeiiillsskskskdk"
     SQLALCHEMY_COMMIT_ON_TEARDOWN = True
     SQLALCHEMY_TRACK_MODIFICATIONS = True
-    SQLALCHEMY_RECORD_QUERIES = True
+    SQLALCHEMY_RECORD_QUERIES = False
     SSL_DISABLE = False
     BLOG_MAIL_SUBJECT_PREFIX = "Bob's Bytes"
     BLOG_MAIL_SENDER = "BOB <bob@bbb.com"
@@ -19,7 +20,72 @@ class Config():
     BLOG_POSTS_PER_PAGE = 25
     BLOG_FOLLOWERS_PER_PAGE = 25
     BLOG_COMMENTS_PER_PAGE = 10
+    # Largest page a client can ask for with ?limit= in the API
+    BLOG_API_MAX_LIMIT = 100
+    # Rows fetched from the cursor and written per chunk by streaming exports
+    BLOG_EXPORT_CHUNK_SIZE = 500
+    # Most ids or new items a single batch API request may carry
+    BLOG_API_BATCH_MAX = 50
     SLOW_DB_QUERY_TIME=0.5
+    # Per request query count, DB time and repeated statements, logged for a sample of requests
+    # Statements slower than SLOW_DB_QUERY_TIME are logged for every request
+    BLOG_QUERY_PROFILER = os.environ.get("BLOG_QUERY_PROFILER", "1") != "0"
+    BLOG_QUERY_PROFILER_SAMPLE_RATE = float(os.environ.get("BLOG_QUERY_PROFILER_SAMPLE_RATE") or 1.0)
+    # A statement shape run this many times in one request is reported as a likely N+1
+    BLOG_QUERY_PROFILER_REPEAT_THRESHOLD = 5
+    # Authors with more followers than this are read on demand instead of fanned out
+    BLOG_TIMELINE_FANOUT_LIMIT = 1000
+    # Number of recent posts copied into a timeline when following someone
+    BLOG_TIMELINE_BACKFILL = 100
+    # Number of rendered Markdown bodies kept in memory per worker
+    BLOG_RENDER_CACHE_SIZE = 1024
+    # Rendered post/comment fragments: "memory" (per worker), "filesystem" (shared) or None
+    BLOG_FRAGMENT_CACHE = os.environ.get("BLOG_FRAGMENT_CACHE") or "memory"
+    BLOG_FRAGMENT_CACHE_SIZE = 2048
+    BLOG_FRAGMENT_CACHE_DIR = os.path.join(basedir, "tmp", "fragments")
+    # Anonymous page cache, entries are fresh for TTL seconds then served stale while refreshed
+    BLOG_PAGE_CACHE = True
+    BLOG_PAGE_CACHE_TTL = 30
+    BLOG_PAGE_CACHE_STALE = 300
+    BLOG_PAGE_CACHE_SIZE = 512
+    # Verified API tokens kept per worker, and the longest they are trusted without re-checking
+    BLOG_TOKEN_CACHE_SIZE = 4096
+    BLOG_TOKEN_CACHE_TTL = 300
+    # Native threads for password hashing under gevent, 0 hashes inline. Werkzeug's default
+    # PBKDF2 is too cheap for the pool to pay off, only enable it for a costlier hash
+    BLOG_HASH_POOL_SIZE = int(os.environ.get("BLOG_HASH_POOL_SIZE") or 0)
+    # last_seen is recorded at most once per resolution and written in batches every interval
+    BLOG_LAST_SEEN_RESOLUTION = 60
+    BLOG_LAST_SEEN_FLUSH_INTERVAL = 30
+    # Seconds a logged in user's row is reused by load_user without a query, and how many are kept
+    BLOG_IDENTITY_CACHE_TTL = 30
+    BLOG_IDENTITY_CACHE_SIZE = 4096
+    # Outgoing mail queue: size, worker threads, messages sent per SMTP connection,
+    # retries with exponential backoff, and how long send_email waits when the queue is full
+    BLOG_MAIL_QUEUE_SIZE = 200
+    BLOG_MAIL_WORKERS = 2
+    BLOG_MAIL_BATCH_SIZE = 20
+    BLOG_MAIL_RETRIES = 3
+    BLOG_MAIL_RETRY_DELAY = 1
+    BLOG_MAIL_QUEUE_TIMEOUT = 5
+    # Serve identicons from /avatar/ instead of linking to gravatar.com
+    BLOG_LOCAL_AVATARS = os.environ.get("BLOG_LOCAL_AVATARS", "1") != "0"
+    BLOG_AVATAR_CACHE_DIR = os.path.join(basedir, "tmp", "avatars")
+    # The sizes the templates ask for, nothing else is drawn
+    BLOG_AVATAR_SIZES = [18, 32, 40, 256]
+    # Full text search: "fts5" (SQLite), "terms" (portable inverted index) or "auto"
+    BLOG_SEARCH_BACKEND = os.environ.get("BLOG_SEARCH_BACKEND") or "auto"
+    BLOG_SEARCH_RESULTS_PER_PAGE = 20
+    # gzip/brotli compression of text responses at least MIN_SIZE bytes long
+    BLOG_COMPRESS = True
+    BLOG_COMPRESS_MIN_SIZE = 500
+    BLOG_COMPRESS_LEVEL = 6
+    BLOG_COMPRESS_BROTLI_QUALITY = 4
+    BLOG_COMPRESS_MIMETYPES = ["text/html", "text/css", "text/plain", "text/xml",
+                               "application/javascript", "application/json",
+                               "application/x-ndjson", "image/svg+xml"]
+    # Written by "manage.py build_assets", maps static files to their content hashed copies
+    BLOG_ASSET_MANIFEST = os.path.join(basedir, "app", "static", "manifest.json")
     
     @staticmethod
     def init_app(app):
@@ -36,11 +102,15 @@ class TestingConfig(Config):
     SQLALCHEMY_DATABASE_URI = os.environ.get("TEST_DATABASE_URI")
     WTF_CSRF_ENABLED = False
     PRESERVE_CONTEXT_ON_EXCEPTION = False
+    BLOG_AVATAR_CACHE_DIR = os.path.join(tempfile.gettempdir(), "blog-test-avatars")
 
 
 class ProductionConfig(Config):
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URI') or \
         'sqlite:///' + os.path.join(basedir, 'data.sqlite')
+    # profile one request in a hundred, the rest only time their statements for slow queries
+    BLOG_QUERY_PROFILER_SAMPLE_RATE = float(
+        os.environ.get("BLOG_QUERY_PROFILER_SAMPLE_RATE") or 0.01)
 
     @classmethod
     def init_app(cls, app):
@@ -16,7 +16,7 @@ if os.path.exists('.env'):
             os.environ[var[0]] = var[1]
 
 from app import create_app, db
-from app.models import User, Role, Post, Permission, Follow, Comment
+from app.models import User, Role, Post, Permission, Follow, Comment, Timeline
 from flask_script import Manager, Shell
 from flask_migrate import Migrate, MigrateCommand
 
@@ -28,7 +28,8 @@ migrate = Migrate(app, db)
 
 def make_shell_context():
     return dict(app=app, db=db, User=User, Role=Role, Permission=Permission,
-                Post=Post, Comment=Comment, Follow=Follow)
+                Post=Post, Comment=Comment, Follow=Follow,
+                Timeline=Timeline)
 
 manager.add_command("shell", Shell(make_context=make_shell_context))
 manager.add_command("db", MigrateCommand)
@@ -62,7 +63,88 @@ def profile(length=25, profile_dir=None):
     app.wsgi_app = ProfilerMiddleware(app.wsgi_app, restrictions=[length],
                                       profile_dir=profile_dir)
     app.run()
-    
-    
+
+
+@manager.command
+def explain():
+    """EXPLAIN the hot queries and flag full table scans."""
+    from app.hot_queries import HOT_QUERIES, explain as explain_query
+    failed = False
+    for hot_query in HOT_QUERIES:
+        plan, scans = explain_query(hot_query())
+        print("%s %s" % ("SCAN" if scans else "ok  ", hot_query.__name__))
+        for line in plan:
+            print("    " + line)
+        failed = failed or bool(scans)
+    # non-zero exit status so index regressions fail the build
+    return 1 if failed else 0
+
+
+@manager.command
+def rerender(chunk_size=500, processes=0, checkpoint="rerender.json", restart=False):
+    """Re-render stale post and comment HTML in a process pool."""
+    from app.render import rerender as rerender_model
+    if restart and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    for model in (Post, Comment):
+        count = rerender_model(db, model, chunk_size=chunk_size,
+                               processes=processes or None,
+                               checkpoint=checkpoint)
+        print("Re-rendered %d %s" % (count, model.__tablename__))
+    # finished, the next run starts from the first row again
+    if os.path.exists(checkpoint):
+        os.remove(checkpoint)
+
+
+@manager.command
+def reindex(chunk_size=1000):
+    """Rebuild the search index, streaming posts and comments in chunks."""
+    from app import search_index
+    connection = db.session.connection()
+    search_index.clear(connection)
+    for model, kind in ((Post, "post"), (Comment, "comment")):
+        rows = db.session.query(model.id, model.body).order_by(model.id) \
+            .yield_per(chunk_size)
+        count = search_index.rebuild(connection, rows, kind, chunk_size=chunk_size)
+        print("Indexed %d %s" % (count, model.__tablename__))
+    db.session.commit()
+
+
+@manager.command
+def build_assets():
+    """Write content hashed copies of the static files and their manifest, then compress them."""
+    from app.assets import build
+    from app.compression import precompress
+    manifest = build(app.static_folder, app.config["BLOG_ASSET_MANIFEST"])
+    for name, hashed in sorted(manifest.items()):
+        print("%s -> %s" % (name, hashed))
+    for path in precompress(app.static_folder):
+        print("Wrote %s" % os.path.relpath(path))
+
+
+@manager.command
+def compress_static():
+    """Write .gz and .br copies of the static files for serving precompressed."""
+    from app.compression import precompress
+    for path in precompress(app.static_folder):
+        print("Wrote %s" % os.path.relpath(path))
+
+
+@manager.command
+def mailsink(host="localhost", port=1025):
+    """Run a local SMTP sink that counts messages instead of delivering them."""
+    import time
+    from app.mail_sink import SinkServer
+    sink = SinkServer(host, port)
+    sink.serve_in_thread()
+    print("Accepting mail on %s:%d, Ctrl-C to stop" % (host, port))
+    try:
+        while True:
+            time.sleep(5)
+            print("%d messages, %.1f/s" % (sink.count, sink.rate()))
+    except KeyboardInterrupt:
+        pass
+
+
 if __name__ == "__main__":
     manager.run()
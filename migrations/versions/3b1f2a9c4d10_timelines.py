@@ -0,0 +1,37 @@
+"""timelines
+
+Revision ID: 3b1f2a9c4d10
+Revises: 075947718603
+Create Date: 2026-10-18 09:12:41.201553
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b1f2a9c4d10'
+down_revision = '075947718603'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('timelines',
+    sa.Column('owner_id', sa.Integer(), nullable=False),
+    sa.Column('post_id', sa.Integer(), nullable=False),
+    sa.Column('timestamp', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['owner_id'], ['users.id'], ),
+    sa.ForeignKeyConstraint(['post_id'], ['posts.id'], ),
+    sa.PrimaryKeyConstraint('owner_id', 'post_id')
+    )
+    op.create_index('ix_timelines_owner_id_timestamp', 'timelines', ['owner_id', 'timestamp'], unique=False)
+    # backfill existing timelines from the follows table
+    op.execute('INSERT INTO timelines (owner_id, post_id, timestamp) '
+               'SELECT follows.follower_id, posts.id, posts.timestamp '
+               'FROM follows JOIN posts ON posts.author_id = follows.followed_id')
+
+
+def downgrade():
+    op.drop_index('ix_timelines_owner_id_timestamp', table_name='timelines')
+    op.drop_table('timelines')
@@ -0,0 +1,39 @@
+"""search index
+
+Revision ID: a9c3e5f7b214
+Revises: f4b7d0c8e615
+Create Date: 2026-10-18 16:42:10.318204
+
+The index starts empty, fill it with "python manage.py reindex"
+"""
+from alembic import op
+import sqlalchemy as sa
+from app.search import fts5_available, CREATE_FTS, DROP_FTS
+
+
+# revision identifiers, used by Alembic.
+revision = 'a9c3e5f7b214'
+down_revision = 'f4b7d0c8e615'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('search_terms',
+    sa.Column('term', sa.String(length=64), nullable=False),
+    sa.Column('kind', sa.String(length=8), nullable=False),
+    sa.Column('doc_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('count', sa.Integer(), nullable=True),
+    sa.PrimaryKeyConstraint('term', 'kind', 'doc_id')
+    )
+    op.create_index('ix_search_terms_kind_doc_id', 'search_terms', ['kind', 'doc_id'], unique=False)
+    bind = op.get_bind()
+    if fts5_available(None, None, bind):
+        op.execute(CREATE_FTS)
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'sqlite':
+        op.execute(DROP_FTS)
+    op.drop_index('ix_search_terms_kind_doc_id', table_name='search_terms')
+    op.drop_table('search_terms')
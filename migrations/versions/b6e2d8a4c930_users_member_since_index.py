@@ -0,0 +1,24 @@
+"""users member_since index
+
+Revision ID: b6e2d8a4c930
+Revises: a9c3e5f7b214
+Create Date: 2026-10-18 17:20:51.774093
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b6e2d8a4c930'
+down_revision = 'a9c3e5f7b214'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(op.f('ix_users_member_since'), 'users', ['member_since'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_users_member_since'), table_name='users')
@@ -0,0 +1,30 @@
+"""hot path indexes
+
+Revision ID: c57a0e9f1b42
+Revises: 8d4e6c2b7a31
+Create Date: 2026-10-18 11:26:05.870412
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c57a0e9f1b42'
+down_revision = '8d4e6c2b7a31'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(op.f('ix_posts_timestamp'), 'posts', ['timestamp'], unique=False)
+    op.create_index('ix_posts_author_id_timestamp', 'posts', ['author_id', 'timestamp'], unique=False)
+    op.create_index('ix_follows_followed_id_follower_id', 'follows', ['followed_id', 'follower_id'], unique=False)
+    op.create_index('ix_comments_post_id_timestamp', 'comments', ['post_id', 'timestamp'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_comments_post_id_timestamp', table_name='comments')
+    op.drop_index('ix_follows_followed_id_follower_id', table_name='follows')
+    op.drop_index('ix_posts_author_id_timestamp', table_name='posts')
+    op.drop_index(op.f('ix_posts_timestamp'), table_name='posts')
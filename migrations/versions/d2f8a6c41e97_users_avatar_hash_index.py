@@ -0,0 +1,24 @@
+"""users avatar_hash index
+
+Revision ID: d2f8a6c41e97
+Revises: b6e2d8a4c930
+Create Date: 2026-10-18 20:04:12.518327
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2f8a6c41e97'
+down_revision = 'b6e2d8a4c930'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(op.f('ix_users_avatar_hash'), 'users', ['avatar_hash'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_users_avatar_hash'), table_name='users')
@@ -0,0 +1,29 @@
+"""render version
+
+Revision ID: e1a93b6d5f28
+Revises: c57a0e9f1b42
+Create Date: 2026-10-18 12:40:52.113907
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e1a93b6d5f28'
+down_revision = 'c57a0e9f1b42'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # existing rows are left NULL (stale) for manage.py rerender or the lazy re-render on load
+    op.add_column('comments', sa.Column('render_version', sa.Integer(), nullable=True))
+    op.add_column('posts', sa.Column('render_version', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('posts') as batch_op:
+        batch_op.drop_column('render_version')
+    with op.batch_alter_table('comments') as batch_op:
+        batch_op.drop_column('render_version')
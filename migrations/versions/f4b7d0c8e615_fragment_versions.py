@@ -0,0 +1,28 @@
+"""fragment versions
+
+Revision ID: f4b7d0c8e615
+Revises: e1a93b6d5f28
+Create Date: 2026-10-18 14:05:29.640381
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f4b7d0c8e615'
+down_revision = 'e1a93b6d5f28'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('comments', sa.Column('version', sa.Integer(), nullable=True, server_default='0'))
+    op.add_column('posts', sa.Column('version', sa.Integer(), nullable=True, server_default='0'))
+
+
+def downgrade():
+    with op.batch_alter_table('posts') as batch_op:
+        batch_op.drop_column('version')
+    with op.batch_alter_table('comments') as batch_op:
+        batch_op.drop_column('version')
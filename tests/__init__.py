@@ -0,0 +1,24 @@
+from contextlib import contextmanager
+from sqlalchemy import event
+from app import db
+
+
+@contextmanager
+def assert_max_queries(testcase, max_queries):
+    """Fails the test if the block runs more than max_queries SQL statements
+    A list page that lazy loads per row blows past a fixed limit as soon as it has a few rows"""
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    engine = db.engine
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+    testcase.assertLessEqual(
+        len(statements), max_queries,
+        "%d queries executed, expected at most %d:\n%s" %
+        (len(statements), max_queries, "\n".join(statements)))
@@ -1,10 +1,13 @@
 import unittest
 import json
 import re
+from datetime import datetime
 from base64 import b64encode
 from flask import url_for
-from app import create_app, db
+from app import create_app, db, token_cache
+from werkzeug.http import http_date
 from app.models import Role, User, Post, Comment
+from app.api_1_0.serializers import format_datetime, json_serializer, msgpack
 
 
 class APITestCase(unittest.TestCase):
@@ -61,4 +64,279 @@ class APITestCase(unittest.TestCase):
         self.assertTrue(json_response["url"] == url)
         self.assertTrue(json_response["body"] == "body of the *blog* post")
         self.assertTrue(json_response["body_html"] == 
-                         "<p>body of the <em>blog</em> post</p>")
\ No newline at end of file
+                         "<p>body of the <em>blog</em> post</p>")
+
+    def test_cursor_pagination(self):
+        r = Role.query.filter_by(name="User").first()
+        u = User(email="john@example.com", password="cat", confirmed=True, role=r)
+        db.session.add(u)
+        for i in range(5):
+            db.session.add(Post(body="post %d" % i, author=u,
+                                timestamp=datetime(2017, 1, 1, 12, i)))
+        db.session.commit()
+        headers = self.get_api_headers("john@example.com", "cat")
+
+        # first page, newest first and no count unless asked for
+        response = self.client.get(url_for("api.get_posts", limit=2),
+                                   headers=headers)
+        self.assertTrue(response.status_code == 200)
+        json_response = json.loads(response.data.decode("utf-8"))
+        self.assertTrue([p["body"] for p in json_response["posts"]] ==
+                        ["post 4", "post 3"])
+        self.assertIsNone(json_response["prev"])
+        self.assertIsNone(json_response["count"])
+
+        # walk forward to the end
+        response = self.client.get(json_response["next"], headers=headers)
+        page2 = json.loads(response.data.decode("utf-8"))
+        self.assertTrue([p["body"] for p in page2["posts"]] ==
+                        ["post 2", "post 1"])
+        response = self.client.get(page2["next"], headers=headers)
+        page3 = json.loads(response.data.decode("utf-8"))
+        self.assertTrue([p["body"] for p in page3["posts"]] == ["post 0"])
+        self.assertIsNone(page3["next"])
+
+        # and back again
+        response = self.client.get(page2["prev"], headers=headers)
+        page1 = json.loads(response.data.decode("utf-8"))
+        self.assertTrue([p["body"] for p in page1["posts"]] ==
+                        ["post 4", "post 3"])
+        self.assertIsNone(page1["prev"])
+
+        # totals are opt in
+        response = self.client.get(url_for("api.get_posts", limit=2, count=1),
+                                   headers=headers)
+        self.assertTrue(json.loads(response.data.decode("utf-8"))["count"] == 5)
+
+        # garbage cursors are rejected
+        response = self.client.get(url_for("api.get_posts", cursor="nope"),
+                                   headers=headers)
+        self.assertTrue(response.status_code == 400)
+
+    def test_conditional_get(self):
+        r = Role.query.filter_by(name="User").first()
+        u = User(email="john@example.com", password="cat", confirmed=True, role=r)
+        p = Post(body="body", author=u)
+        db.session.add_all([u, p])
+        db.session.commit()
+        headers = self.get_api_headers("john@example.com", "cat")
+        response = self.client.get(url_for("api.get_post", id=p.id), headers=headers)
+        self.assertTrue(response.status_code == 200)
+        etag = response.headers.get("ETag")
+        self.assertIsNotNone(etag)
+        # posts change after they are created, so only the ETag validates them
+        self.assertIsNone(response.headers.get("Last-Modified"))
+        headers["If-Modified-Since"] = "Fri, 01 Jan 2100 00:00:00 GMT"
+        response = self.client.get(url_for("api.get_post", id=p.id), headers=headers)
+        self.assertTrue(response.status_code == 200)
+        del headers["If-Modified-Since"]
+
+        # unchanged post
+        headers["If-None-Match"] = etag
+        response = self.client.get(url_for("api.get_post", id=p.id), headers=headers)
+        self.assertTrue(response.status_code == 304)
+        self.assertTrue(response.data == b"")
+        self.assertTrue("Accept" in response.headers.get("Vary"))
+
+        # a new comment changes the comment count and so the ETag
+        db.session.add(Comment(body="comment", author=u, post=p))
+        db.session.commit()
+        response = self.client.get(url_for("api.get_post", id=p.id), headers=headers)
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue(response.headers.get("ETag") != etag)
+
+        # collections too
+        del headers["If-None-Match"]
+        response = self.client.get(url_for("api.get_posts"), headers=headers)
+        headers["If-None-Match"] = response.headers.get("ETag")
+        response = self.client.get(url_for("api.get_posts"), headers=headers)
+        self.assertTrue(response.status_code == 304)
+
+    def test_token_cache(self):
+        r = Role.query.filter_by(name="User").first()
+        u = User(email="john@example.com", password="cat", confirmed=True, role=r)
+        db.session.add(u)
+        db.session.commit()
+        response = self.client.get(
+            url_for("api.get_token"),
+            headers=self.get_api_headers("john@example.com", "cat"))
+        token = json.loads(response.data.decode("utf-8"))["token"]
+
+        # the first request verifies the token, the second one is a cache hit
+        for i in range(2):
+            response = self.client.get(url_for("api.get_posts"),
+                                       headers=self.get_api_headers(token, ""))
+            self.assertTrue(response.status_code == 200)
+        self.assertTrue(len(token_cache.entries) == 1)
+
+        # changing the password drops the cached token
+        u.password = "dog"
+        db.session.add(u)
+        db.session.commit()
+        self.assertTrue(len(token_cache.entries) == 0)
+
+        response = self.client.get(url_for("api.get_posts"),
+                                   headers=self.get_api_headers("bad-token", ""))
+        self.assertTrue(response.status_code == 401)
+
+    def test_search(self):
+        u = User(email="john@example.com", password="cat", confirmed=True)
+        db.session.add(u)
+        db.session.add(Post(body="searching for needles", author=u))
+        db.session.commit()
+        response = self.client.get(
+            url_for("api.search", q="needles"),
+            headers=self.get_api_headers("john@example.com", "cat"))
+        self.assertTrue(response.status_code == 200)
+        json_response = json.loads(response.data.decode("utf-8"))
+        self.assertTrue(len(json_response["results"]) == 1)
+        self.assertTrue(json_response["results"][0]["kind"] == "post")
+        self.assertTrue(json_response["results"][0]["post"]["body"] ==
+                        "searching for needles")
+        response = self.client.get(
+            url_for("api.search"),
+            headers=self.get_api_headers("john@example.com", "cat"))
+        self.assertTrue(response.status_code == 400)
+
+    def test_users(self):
+        r = Role.query.filter_by(name="User").first()
+        for i in range(30):
+            db.session.add(User(email="user%d@example.com" % i, username="user%d" % i,
+                                password="cat", confirmed=True, role=r))
+        db.session.commit()
+        headers = self.get_api_headers("user0@example.com", "cat")
+
+        # pages follow the same rules as the other collections
+        response = self.client.get(url_for("api.get_users"), headers=headers)
+        self.assertTrue(response.status_code == 200)
+        json_response = json.loads(response.data.decode("utf-8"))
+        self.assertTrue(json_response["count"] == 30)
+        self.assertTrue(len(json_response["users"]) ==
+                        self.app.config["BLOG_FOLLOWERS_PER_PAGE"])
+        self.assertIsNotNone(json_response["next"])
+
+        # the export streams every user, one JSON object per line
+        self.app.config["BLOG_EXPORT_CHUNK_SIZE"] = 7
+        response = self.client.get(url_for("api.export_users"), headers=headers)
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue(response.mimetype == "application/x-ndjson")
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertTrue(len(lines) == 30)
+        self.assertTrue(json.loads(lines[0])["username"] == "user0")
+
+    def test_batch(self):
+        r = Role.query.filter_by(name="User").first()
+        u = User(email="john@example.com", username="john", password="cat",
+                 confirmed=True, role=r)
+        db.session.add(u)
+        db.session.commit()
+        headers = self.get_api_headers("john@example.com", "cat")
+
+        # bulk create validates every item before inserting any of them
+        response = self.client.post(
+            url_for("api.new_posts"), headers=headers,
+            data=json.dumps({"posts": [{"body": "first"}, {"body": ""}]}))
+        self.assertTrue(response.status_code == 400)
+        json_response = json.loads(response.data.decode("utf-8"))
+        self.assertTrue([result["status"] for result in json_response["results"]] ==
+                        [201, 400])
+        self.assertTrue(Post.query.count() == 0)
+
+        response = self.client.post(
+            url_for("api.new_posts"), headers=headers,
+            data=json.dumps({"posts": [{"body": "first"}, {"body": "second"}]}))
+        self.assertTrue(response.status_code == 201)
+        json_response = json.loads(response.data.decode("utf-8"))
+        self.assertTrue(json_response["results"][1]["post"]["body"] == "second")
+        ids = [post.id for post in Post.query.order_by(Post.id)]
+
+        response = self.client.post(
+            url_for("api.new_comments"), headers=headers,
+            data=json.dumps({"comments": [{"post_id": ids[0], "body": "nice"},
+                                          {"post_id": ids[1], "body": "also nice"}]}))
+        self.assertTrue(response.status_code == 201)
+        self.assertTrue(Comment.query.count() == 2)
+        response = self.client.post(
+            url_for("api.new_comments"), headers=headers,
+            data=json.dumps({"comments": [{"post_id": 999, "body": "lost"}]}))
+        self.assertTrue(response.status_code == 400)
+        response = self.client.post(
+            url_for("api.new_comments"), headers=headers,
+            data=json.dumps({"comments": [{"post_id": ids[0], "body": "fine"},
+                                          {"post_id": True, "body": "bool"}]}))
+        self.assertTrue(response.status_code == 400)
+        self.assertTrue(Comment.query.count() == 2)
+        response = self.client.post(url_for("api.new_posts"), headers=headers,
+                                    data=json.dumps([{"body": "not wrapped"}]))
+        self.assertTrue(response.status_code == 400)
+
+        # batch reads keep the requested order and report missing ids
+        response = self.client.get(
+            url_for("api.get_posts", ids="%d,999,%d" % (ids[1], ids[0])), headers=headers)
+        self.assertTrue(response.status_code == 200)
+        results = json.loads(response.data.decode("utf-8"))["results"]
+        self.assertTrue([result["status"] for result in results] == [200, 404, 200])
+        self.assertTrue(results[0]["post"]["body"] == "second")
+        response = self.client.get(url_for("api.get_users", ids=str(u.id)), headers=headers)
+        results = json.loads(response.data.decode("utf-8"))["results"]
+        self.assertTrue(results[0]["user"]["username"] == "john")
+
+        # oversized and malformed batches are rejected
+        self.app.config["BLOG_API_BATCH_MAX"] = 2
+        response = self.client.get(url_for("api.get_posts", ids="1,2,3"), headers=headers)
+        self.assertTrue(response.status_code == 400)
+        response = self.client.get(url_for("api.get_posts", ids="1,x"), headers=headers)
+        self.assertTrue(response.status_code == 400)
+
+    def test_fields_and_embed(self):
+        u = User(email="john@example.com", username="john", password="cat", confirmed=True)
+        p = Post(body="sparse", author=u)
+        db.session.add_all([u, p])
+        db.session.commit()
+        headers = self.get_api_headers("john@example.com", "cat")
+
+        response = self.client.get(url_for("api.get_post", id=p.id, fields="id,body"),
+                                   headers=headers)
+        json_response = json.loads(response.data.decode("utf-8"))
+        self.assertTrue(json_response == {"id": p.id, "body": "sparse"})
+
+        response = self.client.get(url_for("api.get_posts", embed="author"), headers=headers)
+        json_response = json.loads(response.data.decode("utf-8"))
+        self.assertTrue(json_response["posts"][0]["author"]["username"] == "john")
+
+        response = self.client.get(url_for("api.get_posts", fields="id,nope"),
+                                   headers=headers)
+        self.assertTrue(response.status_code == 400)
+        response = self.client.get(url_for("api.get_posts", embed="comments"),
+                                   headers=headers)
+        self.assertTrue(response.status_code == 400)
+        # users embed nothing, and the export checks fields before it starts streaming
+        response = self.client.get(url_for("api.get_users", embed="author"), headers=headers)
+        self.assertTrue(response.status_code == 400)
+        response = self.client.get(url_for("api.export_users", fields="nope"), headers=headers)
+        self.assertTrue(response.status_code == 400)
+        self.assertTrue(response.mimetype == "application/json")
+
+    def test_serializers(self):
+        # compact JSON formats datetimes the same way jsonify did
+        when = datetime(2017, 3, 5, 7, 8, 9, 123)
+        self.assertTrue(format_datetime(when) == http_date(when))
+        self.assertTrue(json_serializer.dumps({"a": [1, when]}) ==
+                        '{"a":[1,"%s"]}' % http_date(when))
+
+        u = User(email="john@example.com", password="cat", confirmed=True)
+        db.session.add(u)
+        db.session.commit()
+        headers = self.get_api_headers("john@example.com", "cat")
+        response = self.client.get(url_for("api.get_user", id=u.id), headers=headers)
+        self.assertTrue(response.mimetype == "application/json")
+        self.assertTrue("Accept" in response.headers.get("Vary"))
+        json_etag = response.headers.get("ETag")
+        if msgpack is None:
+            return
+        headers["Accept"] = "application/msgpack"
+        response = self.client.get(url_for("api.get_user", id=u.id), headers=headers)
+        self.assertTrue(response.mimetype == "application/msgpack")
+        self.assertTrue(msgpack.unpackb(response.data, encoding="utf-8")["id"] == u.id)
+        # each representation has its own validator
+        self.assertTrue(response.headers.get("ETag") != json_etag)
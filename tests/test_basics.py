@@ -1,6 +1,7 @@
 import unittest
-from flask import current_app
+from flask import current_app, url_for
 from app import create_app, db
+from app.url_templates import external_url
 
 class BasicsTestCase(unittest.TestCase):
     def setUp(self):
@@ -19,3 +20,41 @@ class BasicsTestCase(unittest.TestCase):
     
     def test_app_is_testing(self):
         self.assertTrue(current_app.config["TESTING"])
+
+    def test_external_url_matches_url_for(self):
+        endpoints = ["api.get_user", "api.get_user_posts", "api.get_user_followed_posts",
+                     "api.get_post", "api.get_post_comments", "api.get_comment"]
+        ids = [0, 1, 7, 42, 1000, 2 ** 40]
+        # every host and mount point gets its own template
+        contexts = [dict(base_url="http://localhost/"),
+                    dict(base_url="https://example.com/"),
+                    dict(base_url="http://example.com:8080/blog/")]
+        for context in contexts:
+            with self.app.test_request_context(**context):
+                for endpoint in endpoints:
+                    for id in ids:
+                        self.assertEqual(external_url(endpoint, id),
+                                         url_for(endpoint, id=id, _external=True))
+
+    def test_external_url_templates_are_bounded(self):
+        from app.url_templates import MAX_TEMPLATES
+        # the host comes from each request
+        self.app.config["SERVER_NAME"] = None
+        for i in range(MAX_TEMPLATES + 10):
+            with self.app.test_request_context(base_url="http://host%d.example.com/" % i):
+                self.assertEqual(external_url("api.get_post", 1),
+                                 "http://host%d.example.com/api/v1.0/posts/1" % i)
+        self.assertTrue(len(self.app.extensions["url_templates"]) <= MAX_TEMPLATES)
+
+    def test_models_register_session_listeners(self):
+        from flask_sqlalchemy import SignallingSession
+        from app import page_cache
+        import app.models
+        self.assertTrue(db.event.contains(SignallingSession, "after_commit",
+                                          page_cache.on_commit))
+
+    def test_hot_queries_use_indexes(self):
+        from app.hot_queries import HOT_QUERIES, explain
+        for hot_query in HOT_QUERIES:
+            plan, scans = explain(hot_query())
+            self.assertEqual(scans, [], hot_query.__name__)
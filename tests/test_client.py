@@ -1,8 +1,16 @@
+import gzip
+import json
+import os
 import re
+import shutil
+import tempfile
 import unittest
 from flask import url_for
-from app import create_app, db
-from app.models import User, Role
+from app import create_app, db, assets, avatar_cache
+from app.assets import build
+from app.compression import precompress
+from app.models import User, Role, Post, Comment
+from tests import assert_max_queries
 
 class FlaskClientTestCase(unittest.TestCase):
     def setUp(self):
@@ -53,5 +61,175 @@ class FlaskClientTestCase(unittest.TestCase):
         response = self.client.get(url_for("auth.logout"), follow_redirects=True)
         data = response.get_data(as_text=True)
         self.assertTrue("You have been logged out" in data)
-        
-        
\ No newline at end of file
+
+    def add_users_with_posts(self, count):
+        users = [User(email="user%d@example.com" % i, username="user%d" % i,
+                      password="cat", confirmed=True) for i in range(count)]
+        db.session.add_all(users)
+        db.session.commit()
+        posts = [Post(body="post by %s" % u.username, author=u) for u in users]
+        db.session.add_all(posts)
+        db.session.commit()
+        return users, posts
+
+    def test_index_query_count(self):
+        self.add_users_with_posts(10)
+        db.session.remove()
+        # the page and count queries, not one per post author
+        with assert_max_queries(self, 4):
+            response = self.client.get(url_for("main.index"))
+        self.assertTrue("post by user9" in response.get_data(as_text=True))
+
+    def test_moderate_query_count(self):
+        users, posts = self.add_users_with_posts(10)
+        admin_role = Role.query.filter_by(permissions=0xff).first()
+        admin = User(email="admin@example.com", username="admin",
+                     password="cat", confirmed=True, role=admin_role)
+        db.session.add(admin)
+        db.session.add_all([Comment(body="comment by %s" % u.username,
+                                    author=u, post=posts[0]) for u in users])
+        db.session.commit()
+        self.client.post(url_for("auth.login"), data={
+            "email": "admin@example.com",
+            "password": "cat"
+        })
+        db.session.remove()
+        # loading the admin, its role, the last_seen update, the page and the count
+        with assert_max_queries(self, 8):
+            response = self.client.get(url_for("main.moderate"))
+        self.assertTrue("comment by user9" in response.get_data(as_text=True))
+
+    def test_post_fragment_cache(self):
+        users, posts = self.add_users_with_posts(1)
+        response = self.client.get(url_for("main.index"))
+        self.assertTrue("post by user0" in response.get_data(as_text=True))
+        # editing the body bumps the version, the old fragment is not served
+        posts[0].body = "edited body"
+        db.session.commit()
+        response = self.client.get(url_for("main.index"))
+        data = response.get_data(as_text=True)
+        self.assertTrue("edited body" in data)
+        self.assertFalse("post by user0" in data)
+        # so does adding a comment
+        db.session.add(Comment(body="comment", author=users[0], post=posts[0]))
+        db.session.commit()
+        response = self.client.get(url_for("main.index"))
+        self.assertTrue("1 Comments" in response.get_data(as_text=True))
+
+    def test_anonymous_page_cache(self):
+        users, posts = self.add_users_with_posts(1)
+        response = self.client.get(url_for("main.post", id=posts[0].id))
+        self.assertTrue(response.headers.get("X-Page-Cache") == "miss")
+        response = self.client.get(url_for("main.post", id=posts[0].id))
+        self.assertTrue(response.headers.get("X-Page-Cache") == "hit")
+        # a committed comment marks the page stale, the next request regenerates it
+        db.session.add(Comment(body="new comment", author=users[0], post=posts[0]))
+        db.session.commit()
+        response = self.client.get(url_for("main.post", id=posts[0].id))
+        self.assertTrue(response.headers.get("X-Page-Cache") == "miss")
+        self.assertTrue("new comment" in response.get_data(as_text=True))
+
+    def test_local_avatar(self):
+        u = User(email="john@example.com", username="john", password="cat")
+        db.session.add(u)
+        db.session.commit()
+        response = self.client.get("/avatar/%s/40" % u.avatar_hash)
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue(response.mimetype == "image/png")
+        self.assertTrue("immutable" in response.headers["Cache-Control"])
+        # the second request is read back from the disk cache
+        again = self.client.get("/avatar/%s/40" % u.avatar_hash)
+        self.assertTrue(again.get_data() == response.get_data())
+        self.assertTrue(self.client.get("/avatar/not-a-hash/40").status_code == 404)
+        self.assertTrue(self.client.get("/avatar/%s/4096" % u.avatar_hash).status_code == 404)
+        # only the sizes the templates use, and only hashes that belong to a user
+        self.assertTrue(self.client.get("/avatar/%s/41" % u.avatar_hash).status_code == 404)
+        unknown = "0" * 32
+        self.assertTrue(self.client.get("/avatar/%s/40" % unknown).status_code == 404)
+        self.assertFalse(os.path.exists(avatar_cache.filename(unknown, 40)))
+        self.assertTrue(u.avatar_url(size=100).endswith("/256"))
+
+    def test_compression(self):
+        response = self.client.get(url_for("main.index"), headers={"Accept-Encoding": "gzip"})
+        self.assertTrue(response.headers.get("Content-Encoding") == "gzip")
+        self.assertTrue("Accept-Encoding" in response.headers.get("Vary"))
+        self.assertTrue("Stranger" in gzip.decompress(response.get_data()).decode("utf-8"))
+        # the weak validator still gets a 304
+        response = self.client.get(url_for("main.index"), headers={
+            "Accept-Encoding": "gzip", "If-None-Match": response.headers["ETag"]})
+        self.assertTrue(response.status_code == 304)
+        # bodies below the threshold and clients without gzip get the identity body
+        response = self.client.get(url_for("main.health_check"),
+                                   headers={"Accept-Encoding": "gzip"})
+        self.assertTrue(response.get_data() == b"success")
+        response = self.client.get(url_for("main.index"))
+        self.assertTrue("Content-Encoding" not in response.headers)
+
+    def test_precompressed_static(self):
+        directory = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(directory, "site.css"), "w") as f:
+                f.write("body { margin: 0; }\n" * 100)
+            written = precompress(directory)
+            self.assertTrue(os.path.join(directory, "site.css.gz") in written)
+            with gzip.open(os.path.join(directory, "site.css.gz"), "rt") as f:
+                self.assertTrue(f.read() == "body { margin: 0; }\n" * 100)
+            # nothing changed, nothing is rewritten
+            self.assertTrue(precompress(directory) == [])
+        finally:
+            shutil.rmtree(directory)
+
+    def test_fingerprinted_assets(self):
+        directory = tempfile.mkdtemp()
+        static_folder = self.app.static_folder
+        try:
+            shutil.copy(os.path.join(static_folder, "styles.css"), directory)
+            self.app.static_folder = directory
+            manifest = build(directory, os.path.join(directory, "manifest.json"))
+            assets.load(os.path.join(directory, "manifest.json"))
+            # templates render relative URLs, build the expected one the same way
+            with self.app.test_request_context():
+                hashed_url = url_for("static", filename=manifest["styles.css"])
+            self.assertTrue(hashed_url.startswith("/static/styles."))
+            self.assertTrue(hashed_url in self.client.get(url_for("main.index"))
+                            .get_data(as_text=True))
+            response = self.client.get(hashed_url)
+            self.assertTrue(response.status_code == 200)
+            self.assertTrue("immutable" in response.headers["Cache-Control"])
+            self.assertTrue("max-age=31536000" in response.headers["Cache-Control"])
+            # the unhashed name keeps the default caching
+            response = self.client.get(url_for("static", filename="styles.css"))
+            self.assertTrue("immutable" not in response.headers.get("Cache-Control", ""))
+            # without the manifest, copies from earlier builds are not hashed again
+            os.remove(os.path.join(directory, "manifest.json"))
+            self.assertTrue(build(directory, os.path.join(directory, "manifest.json")) ==
+                            manifest)
+            self.assertTrue(sorted(os.listdir(directory)) ==
+                            sorted(["manifest.json", "styles.css", manifest["styles.css"]]))
+        finally:
+            self.app.static_folder = static_folder
+            assets.load(self.app.config["BLOG_ASSET_MANIFEST"])
+            shutil.rmtree(directory)
+
+    def test_query_profiler(self):
+        self.add_users_with_posts(3)
+        self.app.config["BLOG_QUERY_PROFILER_REPEAT_THRESHOLD"] = 1
+        with self.assertLogs(self.app.logger, level="INFO") as logs:
+            self.client.get(url_for("main.user", username="user0"))
+        lines = [json.loads(line.split("query profile ", 1)[1])
+                 for line in logs.output if "query profile" in line]
+        self.assertTrue(len(lines) == 1)
+        self.assertTrue(lines[0]["endpoint"] == "main.user")
+        self.assertTrue(lines[0]["queries"] > 0)
+        self.assertTrue(lines[0]["repeated"])
+        # unsampled requests log nothing (other users' pages aren't cached yet)
+        self.app.config["BLOG_QUERY_PROFILER_SAMPLE_RATE"] = 0
+        with self.assertRaises(AssertionError):
+            with self.assertLogs(self.app.logger, level="INFO"):
+                self.client.get(url_for("main.user", username="user1"))
+        # except slow statements, which are reported on every request
+        self.app.config["SLOW_DB_QUERY_TIME"] = 0
+        with self.assertLogs(self.app.logger, level="INFO") as logs:
+            self.client.get(url_for("main.user", username="user2"))
+        self.assertTrue(logs.output)
+        self.assertTrue(all("Slow query" in line for line in logs.output))
@@ -0,0 +1,56 @@
+import unittest
+from app import create_app, db, mail
+from app.email import mail_queue, send_email
+from app.models import User, Role
+
+
+class EmailTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app("testing")
+        self.app_context = self.app.test_request_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_mail_queue(self):
+        # sends go through the worker pool and every queued message is delivered
+        user = User(username="john", email="john@example.com", password="cat")
+        with mail.record_messages() as outbox:
+            for i in range(5):
+                self.assertTrue(send_email(user.email, "Confirm Your Account",
+                                           "auth/email/confirm", user=user, token="abc"))
+            mail_queue.join()
+        self.assertEqual(len(outbox), 5)
+        self.assertEqual(outbox[0].recipients, ["john@example.com"])
+
+    def test_mail_queue_survives_bad_messages(self):
+        from flask_mail import Message
+        with mail.record_messages() as outbox:
+            # no recipients fails inside Flask-Mail, not with an SMTP error
+            self.assertTrue(mail_queue.put(Message("broken", sender="bob@example.com")))
+            self.assertTrue(mail_queue.put(Message("fine", sender="bob@example.com",
+                                                   recipients=["john@example.com"])))
+            mail_queue.join()
+        self.assertEqual([msg.subject for msg in outbox], ["fine"])
+        self.assertTrue(all(worker.is_alive() for worker in mail_queue.workers))
+
+    def test_mail_sink(self):
+        import smtplib
+        from app.mail_sink import SinkServer
+        sink = SinkServer("localhost", 0)
+        sink.serve_in_thread()
+        try:
+            smtp = smtplib.SMTP(*sink.server_address)
+            for i in range(3):
+                smtp.sendmail("bob@example.com", ["john@example.com"],
+                              "Subject: %d\r\n\r\nline\r\n.leading dot\r\n" % i)
+            smtp.quit()
+        finally:
+            sink.shutdown()
+            sink.server_close()
+        self.assertEqual(sink.count, 3)
@@ -0,0 +1,94 @@
+import json
+import os
+import tempfile
+import unittest
+from app import create_app, db, render_cache
+from app.models import Post, Comment
+from app.render import RenderCache, RENDERER_VERSION, rerender
+
+
+class RenderCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app("testing")
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        render_cache.clear()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_identical_bodies_render_once(self):
+        p1 = Post(body="*same* body")
+        p2 = Post(body="*same* body")
+        self.assertTrue(p1.body_html == p2.body_html == "<p><em>same</em> body</p>")
+        stats = render_cache.stats()
+        self.assertTrue(stats["misses"] == 1)
+        self.assertTrue(stats["hits"] == 1)
+
+    def test_allowed_tags_are_part_of_the_key(self):
+        p = Post(body="# title")
+        c = Comment(body="# title")
+        self.assertTrue(p.body_html == "<h1>title</h1>")
+        self.assertTrue(c.body_html == "title")
+        self.assertTrue(render_cache.stats()["misses"] == 2)
+
+    def test_unchanged_body_is_not_rendered(self):
+        p = Post(body="body")
+        p.body = "body"
+        self.assertTrue(render_cache.stats()["misses"] == 1)
+        self.assertTrue(render_cache.stats()["hits"] == 0)
+
+    def test_eviction(self):
+        cache = RenderCache(maxsize=2)
+        for body in ["a", "b", "a", "c"]:
+            cache.render(body, ["p"])
+        # "b" was the least recently used entry
+        self.assertTrue(cache.stats()["evictions"] == 1)
+        cache.render("a", ["p"])
+        cache.render("b", ["p"])
+        self.assertTrue(cache.stats()["hits"] == 2)
+        self.assertTrue(cache.stats()["misses"] == 4)
+
+    def test_stale_rows_rerender_on_load(self):
+        p = Post(body="*fresh*")
+        db.session.add(p)
+        db.session.commit()
+        self.assertTrue(p.render_version == RENDERER_VERSION)
+        Post.query.filter_by(id=p.id).update(
+            {"body_html": "stale", "render_version": RENDERER_VERSION - 1})
+        db.session.commit()
+        db.session.remove()
+        p = Post.query.first()
+        self.assertTrue(p.body_html == "<p><em>fresh</em></p>")
+        self.assertTrue(p.render_version == RENDERER_VERSION)
+
+    def test_rerender(self):
+        posts = [Post(body="*post %d*" % i) for i in range(5)]
+        db.session.add_all(posts)
+        db.session.commit()
+        ids = [p.id for p in posts]
+        Post.query.update({"body_html": "stale", "render_version": RENDERER_VERSION - 1},
+                          synchronize_session=False)
+        db.session.commit()
+        fd, checkpoint = tempfile.mkstemp(suffix=".json")
+        os.close(fd)
+        try:
+            # a checkpoint from the previous renderer version is ignored
+            with open(checkpoint, "w") as f:
+                json.dump({"renderer_version": RENDERER_VERSION - 1, "posts": ids[-1]}, f)
+            count = rerender(db, Post, chunk_size=2, processes=1, checkpoint=checkpoint)
+            self.assertTrue(count == 5)
+            with open(checkpoint) as f:
+                self.assertTrue(json.load(f) == {"renderer_version": RENDERER_VERSION,
+                                                 "posts": ids[-1]})
+            db.session.remove()
+            for p in Post.query.all():
+                self.assertTrue(p.body_html.startswith("<p><em>post"))
+                self.assertTrue(p.render_version == RENDERER_VERSION)
+            # nothing is stale any more
+            self.assertTrue(rerender(db, Post, processes=1, checkpoint=checkpoint) == 0)
+        finally:
+            os.remove(checkpoint)
@@ -0,0 +1,79 @@
+import unittest
+from app import create_app, db, search_index
+from app.models import Role, User, Post, Comment
+
+
+class SearchTestCase(unittest.TestCase):
+    backend = "auto"
+
+    def setUp(self):
+        self.app = create_app("testing")
+        self.app.config["BLOG_SEARCH_BACKEND"] = self.backend
+        search_index.init_app(self.app)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def search(self, q, kind=None):
+        return [(kind, row.id) for kind, row, score in search_index.results(q, kind=kind)[0]]
+
+    def test_incremental_index(self):
+        u = User(email="john@example.com", password="cat")
+        p1 = Post(body="Brewing coffee at home", author=u)
+        p2 = Post(body="Coffee, coffee and more coffee", author=u)
+        db.session.add_all([u, p1, p2])
+        db.session.commit()
+        c = Comment(body="Tea is better than coffee", author=u, post=p1)
+        db.session.add(c)
+        db.session.commit()
+        # the post that repeats the term ranks first
+        self.assertEqual(self.search("coffee")[0], ("post", p2.id))
+        self.assertEqual(set(self.search("coffee")),
+                         {("post", p1.id), ("post", p2.id), ("comment", c.id)})
+        self.assertEqual(self.search("coffee", kind="comment"), [("comment", c.id)])
+        # every term has to match
+        self.assertEqual(self.search("brewing coffee"), [("post", p1.id)])
+
+        # edits replace the old terms
+        p1.body = "Brewing tea at home"
+        db.session.add(p1)
+        db.session.commit()
+        self.assertEqual(self.search("brewing coffee"), [])
+        self.assertEqual(self.search("brewing tea"), [("post", p1.id)])
+
+        # disabled comments are hidden and deleted rows drop out of the index
+        c.disabled = True
+        db.session.add(c)
+        db.session.delete(p2)
+        db.session.commit()
+        self.assertEqual(self.search("coffee"), [])
+
+        # rolled back changes never reach the index
+        p1.body = "Rolled back coffee"
+        db.session.add(p1)
+        db.session.flush()
+        db.session.rollback()
+        self.assertEqual(self.search("rolled"), [])
+
+    def test_rebuild(self):
+        u = User(email="john@example.com", password="cat")
+        db.session.add_all([u, Post(body="first post", author=u),
+                            Post(body="second post", author=u)])
+        db.session.commit()
+        connection = db.session.connection()
+        search_index.clear(connection)
+        self.assertEqual(self.search("post"), [])
+        rows = db.session.query(Post.id, Post.body).order_by(Post.id).yield_per(1)
+        self.assertEqual(search_index.rebuild(connection, rows, "post", chunk_size=1), 2)
+        self.assertEqual(len(self.search("post")), 2)
+
+
+class TermsSearchTestCase(SearchTestCase):
+    # the portable inverted index used when FTS5 isn't available
+    backend = "terms"
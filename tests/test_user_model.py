@@ -1,8 +1,12 @@
+import threading
 import unittest
 import time
 from datetime import datetime
-from app import create_app, db
-from app.models import User, Role, Permission, AnonymousUser, Follow
+from app import create_app, db, identity_cache, last_seen
+from app.hashing import HashPool
+from app.models import User, Role, Permission, AnonymousUser, Follow, Post, \
+    Comment, Timeline, load_user
+from tests import assert_max_queries
 
 class UserModelTestCase(unittest.TestCase):
     def setUp(self):
@@ -36,6 +40,23 @@ class UserModelTestCase(unittest.TestCase):
         u2 = User(password="cat")
         self.assertTrue(u.password_hash != u2.password_hash)
 
+    def test_hash_pool(self):
+        from multiprocessing.pool import ThreadPool
+        pool = HashPool(self.app)
+        # not under gevent, hashing runs inline
+        self.assertIsNone(pool.pool)
+        password_hash = pool.generate_password_hash("cat")
+        self.assertTrue(pool.check_password_hash(password_hash, "cat"))
+        self.assertFalse(pool.check_password_hash(password_hash, "dog"))
+        # with a pool the work runs on its threads
+        pool.pool = ThreadPool(1)
+        try:
+            main_thread = threading.current_thread()
+            self.assertTrue(pool.run(threading.current_thread) is not main_thread)
+            self.assertTrue(pool.check_password_hash(password_hash, "cat"))
+        finally:
+            pool.pool.terminate()
+
     def test_valid_confirmation_token(self):
         u = User(password="cat")
         db.session.add(u)
@@ -186,3 +207,141 @@ class UserModelTestCase(unittest.TestCase):
         db.session.delete(u2)
         db.session.commit()
         self.assertTrue(Follow.query.count() == 1)
+
+    def test_timeline(self):
+        u1 = User(email='john@example.com', password='cat')
+        u2 = User(email='susan@example.org', password='dog')
+        db.session.add_all([u1, u2])
+        db.session.commit()
+        p1 = Post(body='first', author=u1)
+        db.session.add(p1)
+        db.session.commit()
+        # following backfills the existing posts
+        u2.follow(u1)
+        db.session.commit()
+        self.assertTrue(Timeline.query.filter_by(owner_id=u2.id, post_id=p1.id).count() == 1)
+        # new posts are fanned out to every follower, including the author
+        p2 = Post(body='second', author=u1)
+        db.session.add(p2)
+        db.session.commit()
+        self.assertTrue(Timeline.query.filter_by(post_id=p2.id).count() == 2)
+        self.assertTrue(u2.followed_posts.order_by(Post.timestamp.desc()).all() == [p2, p1])
+        # unfollowing trims the timeline
+        u2.unfollow(u1)
+        db.session.commit()
+        self.assertTrue(Timeline.query.filter_by(owner_id=u2.id).count() == 0)
+        self.assertTrue(u2.followed_posts.count() == 0)
+
+    def test_timeline_heavy_author(self):
+        self.app.config['BLOG_TIMELINE_FANOUT_LIMIT'] = 1
+        u1 = User(email='john@example.com', password='cat')
+        u2 = User(email='susan@example.org', password='dog')
+        db.session.add_all([u1, u2])
+        db.session.commit()
+        u2.follow(u1)
+        db.session.commit()
+        p = Post(body='heavy', author=u1)
+        db.session.add(p)
+        db.session.commit()
+        # no rows were written, the post is read from the posts table instead
+        self.assertTrue(Timeline.query.filter_by(post_id=p.id).count() == 0)
+        self.assertTrue(u2.followed_posts.all() == [p])
+        self.assertTrue(u1.followed_posts.all() == [p])
+        # dropping back under the limit copies the post into the remaining timelines
+        u2.unfollow(u1)
+        db.session.commit()
+        self.assertTrue(Timeline.query.filter_by(post_id=p.id).count() == 1)
+        self.assertTrue(u1.followed_posts.all() == [p])
+        self.assertTrue(u2.followed_posts.count() == 0)
+
+    def test_counters(self):
+        u1 = User(email='john@example.com', password='cat')
+        u2 = User(email='susan@example.org', password='dog')
+        db.session.add_all([u1, u2])
+        db.session.commit()
+        self.assertTrue(u1.follower_count == 1 and u1.followed_count == 1)
+        u2.follow(u1)
+        p = Post(body='post', author=u1)
+        db.session.add(p)
+        db.session.commit()
+        c = Comment(body='comment', author=u2, post=p)
+        db.session.add(c)
+        db.session.commit()
+        self.assertTrue(u1.post_count == 1)
+        self.assertTrue(u1.follower_count == 2)
+        self.assertTrue(u2.followed_count == 2)
+        self.assertTrue(p.comment_count == 1)
+        u2.unfollow(u1)
+        db.session.delete(c)
+        db.session.commit()
+        self.assertTrue(u1.follower_count == 1)
+        self.assertTrue(u2.followed_count == 1)
+        self.assertTrue(p.comment_count == 0)
+
+    def test_last_seen_buffer(self):
+        u = User(password='cat')
+        db.session.add(u)
+        db.session.commit()
+        last_seen_before = u.last_seen
+        time.sleep(1)
+        buffer = last_seen
+        buffer.touch(u.id)
+        # a second touch inside the resolution is dropped
+        buffer.touch(u.id)
+        self.assertTrue(len(buffer.pending) == 1)
+        # rows written by a transaction that rolls back stay buffered
+        buffer.flush()
+        db.session.rollback()
+        self.assertTrue(len(buffer.pending) == 1)
+        buffer.flush()
+        db.session.commit()
+        db.session.refresh(u)
+        self.assertTrue(u.last_seen > last_seen_before)
+        self.assertTrue(len(buffer.pending) == 0)
+        # recorded users older than the resolution are pruned by the next flush
+        buffer.resolution = 0
+        buffer.flush()
+        self.assertTrue(len(buffer.recorded) == 0)
+
+    def test_identity_cache(self):
+        u = User(email='john@example.com', username='john', password='cat')
+        db.session.add(u)
+        db.session.commit()
+        user_id = str(u.id)
+        # the first load queries the user, the next ones the roles once
+        for i in range(2):
+            db.session.remove()
+            load_user(user_id)
+        db.session.remove()
+        with assert_max_queries(self, 0):
+            u = load_user(user_id)
+            self.assertTrue(u.username == 'john')
+            self.assertTrue(u.can(Permission.WRITE_ARTICLES))
+        # committed changes are seen by the next load
+        u.username = 'susan'
+        db.session.add(u)
+        db.session.commit()
+        db.session.remove()
+        self.assertTrue(load_user(user_id).username == 'susan')
+        # so are counter changes, which don't go through the session's dirty list
+        db.session.add(Post(body='post', author_id=int(user_id)))
+        db.session.commit()
+        db.session.remove()
+        self.assertTrue(load_user(user_id).post_count == 1)
+
+    def test_identity_cache_is_bounded(self):
+        users = [User(email='%d@example.com' % i, username='user%d' % i, password='cat')
+                 for i in range(3)]
+        db.session.add_all(users)
+        db.session.commit()
+        ids = [u.id for u in users]
+        identity_cache.maxsize = 2
+        for user_id in ids:
+            load_user(str(user_id))
+        self.assertTrue(list(identity_cache.users) == ids[1:])
+        # expired entries are dropped by the next insert
+        identity_cache.clear()
+        identity_cache.ttl = -1
+        for user_id in ids:
+            load_user(str(user_id))
+        self.assertTrue(len(identity_cache.users) == 0)